@@ -4,7 +4,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from api.config import Settings
+from api.database import engine, pool_stats
 from api.public import api as public_api
+from api.public.ws.connection_manager import manager as connection_manager
+from api.utils.http_client import upstream
 from api.utils.logger import logger_config
 
 logger = logger_config(__name__)
@@ -13,10 +16,16 @@ logger = logger_config(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("startup: triggered")
+    await upstream.start()
+    await connection_manager.start()
 
     yield
 
     logger.info("shutdown: triggered")
+    await connection_manager.stop()
+    await upstream.close()
+    logger.info(f"shutdown: database pool {pool_stats()}")
+    await engine.dispose()
 
 
 def create_app(settings: Settings):
@@ -1,24 +1,53 @@
+from api.auth.cache import TokenCache
+from api.auth.local import LocalTokenVerifier
 from api.auth.schemas import ClientData
 from api.config import settings
+from api.utils.http_client import upstream
 from typing import Union
 from fastapi import Cookie, HTTPException, Query, WebSocket, status, WebSocketException
-import httpx
-
-
-HEADER_KEY = 'Authorization'
+import jwt
+
+
+token_cache = TokenCache(
+    ttl=settings.AUTH_CACHE_TTL,
+    negative_ttl=settings.AUTH_CACHE_NEGATIVE_TTL,
+    max_size=settings.AUTH_CACHE_MAX_SIZE,
+)
+
+local_verifier = None
+if settings.AUTH_MODE == 'local' and settings.JWT_KEY:
+    local_verifier = LocalTokenVerifier(
+        key=settings.JWT_KEY,
+        algorithms=settings.JWT_ALGORITHMS,
+        id_claim=settings.JWT_ID_CLAIM,
+        audience=settings.JWT_AUDIENCE,
+        issuer=settings.JWT_ISSUER,
+        leeway=settings.JWT_LEEWAY,
+        required_claims=settings.JWT_REQUIRED_CLAIMS,
+    )
+
+
+async def fetch_user(token: str):
+    resp = await upstream.request('GET', '/auth/users/me/', token=token)
+    if resp.status_code == 200:
+        return resp.json()
+    # Upstream failures are raised so they don't get cached as a rejected token
+    if resp.status_code >= 500:
+        resp.raise_for_status()
+    return None
 
 
 async def get_user(token: str):
+    if local_verifier is not None:
+        try:
+            user = local_verifier.get_user(token)
+        except jwt.InvalidTokenError:
+            return None
+        if user is not None:
+            return user
+        # Valid token without user claims, let the backend resolve it
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(
-                url=f"{settings.AUTH_URI}/auth/users/me/",
-                headers={
-                    HEADER_KEY: 'JWT ' + token
-                }
-            )
-            if resp.status_code == 200:
-                return resp.json()
+        return await token_cache.get_or_load(token, fetch_user)
     except Exception as e:
         print(e)
     return None
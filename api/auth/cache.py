@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import json
+from collections import OrderedDict
+from time import monotonic, time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+def token_expiry(token: str) -> Optional[float]:
+    '''
+    Read the `exp` claim (unix seconds) of a JWT without verifying it.
+    Only used to keep cache entries from outliving the token itself.
+    '''
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+
+class TokenCache:
+    """
+    In-process token -> user cache.
+    - Entries expire after `ttl` seconds (`negative_ttl` for rejected tokens),
+      and never later than the token's own `exp` claim.
+    - At most `max_size` entries are kept, least recently used are evicted first.
+    - Concurrent lookups for the same token share a single upstream call.
+    """
+    def __init__(self, ttl: float = 60, negative_ttl: float = 5, max_size: int = 10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, Tuple[float, Optional[dict]]]' = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.evictions = 0
+
+    async def get_or_load(
+        self,
+        token: str,
+        loader: Callable[[str], Awaitable[Optional[dict]]],
+    ) -> Optional[dict]:
+        entry = self._entries.get(token)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > monotonic():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return value
+            del self._entries[token]
+
+        task = self._inflight.get(token)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(token, loader))
+            task.add_done_callback(_consume_exception)
+            self._inflight[token] = task
+        else:
+            self.collapsed += 1
+        # A cancelled caller must not cancel the lookup other callers are waiting on
+        return await asyncio.shield(task)
+
+    async def _load(self, token: str, loader: Callable[[str], Awaitable[Optional[dict]]]):
+        try:
+            value = await loader(token)
+        finally:
+            self._inflight.pop(token, None)
+        self._store(token, value)
+        return value
+
+    def _store(self, token: str, value: Optional[dict]):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        exp = token_expiry(token)
+        if exp is not None:
+            ttl = min(ttl, exp - time())
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self._entries[token] = (monotonic() + ttl, value)
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, token: str):
+        self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'collapsed': self.collapsed,
+            'evictions': self.evictions,
+        }
+
+
+def _consume_exception(task: asyncio.Task):
+    # Retrieve the exception so an unawaited failure doesn't log a warning
+    if not task.cancelled():
+        task.exception()
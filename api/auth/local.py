@@ -0,0 +1,52 @@
+from typing import Iterable, List, Optional
+
+import jwt
+
+
+class LocalTokenVerifier:
+    """
+    Verifies JWTs in-process against a shared secret (HS*) or a public key (RS*/ES*,
+    requires the `cryptography` package), instead of asking the auth backend.
+    A token without the id claim or any of `required_claims` is left to the backend.
+    """
+    def __init__(
+        self,
+        key: str,
+        algorithms: List[str],
+        id_claim: str = 'id',
+        audience: Optional[str] = None,
+        issuer: Optional[str] = None,
+        leeway: float = 0,
+        required_claims: Iterable[str] = ('full_name', 'profile_image'),
+    ):
+        self.key = key
+        self.algorithms = algorithms
+        self.id_claim = id_claim
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.required_claims = tuple(required_claims)
+
+    def get_user(self, token: str) -> Optional[dict]:
+        '''
+        Return the user carried by a valid token, or None if the token is valid
+        but lacks any of the user claims (the caller should then ask the backend).
+        Raises jwt.InvalidTokenError for bad signatures, expired tokens, etc.
+        '''
+        claims = jwt.decode(
+            token,
+            key=self.key,
+            algorithms=self.algorithms,
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={'require': ['exp'], 'verify_aud': self.audience is not None},
+        )
+        user_id = claims.get(self.id_claim)
+        if user_id is None or any(claim not in claims for claim in self.required_claims):
+            return None
+        return {
+            'id': user_id,
+            'full_name': claims.get('full_name'),
+            'profile_image': claims.get('profile_image'),
+        }
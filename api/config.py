@@ -14,8 +14,88 @@ class Settings:
     VERSION: str = "0.1"
     SECRET_KEY: str = secrets.token_urlsafe(32)
     DATABASE_URI: str = os.getenv('DATABASE_URI', 'sqlite:///database.db')
+    # Connection pool, per worker process: size it so workers * (size + overflow) fits the server
+    DB_POOL_SIZE: int = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW: int = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT: float = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE: int = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING: bool = os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true'
+    DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+    DB_SQLITE_WAL: bool = os.getenv('DB_SQLITE_WAL', 'True').lower() == 'true'
+    # Most chats accepted by one bulk request or SEND-MESSAGES frame
+    CHAT_BULK_MAX_SIZE: int = int(os.getenv('CHAT_BULK_MAX_SIZE', 500))
+    # Conversation history pages (REST and FETCH-CONVERSATION)
+    CHAT_PAGE_SIZE: int = int(os.getenv('CHAT_PAGE_SIZE', 20))
+    CHAT_PAGE_MAX_SIZE: int = int(os.getenv('CHAT_PAGE_MAX_SIZE', 100))
+    # Conversations per inbox page (CONVERSATION-LIST and GET /chat/conversations)
+    INBOX_PAGE_SIZE: int = int(os.getenv('INBOX_PAGE_SIZE', 50))
+    INBOX_PAGE_MAX_SIZE: int = int(os.getenv('INBOX_PAGE_MAX_SIZE', 200))
+    # Newest messages of recently read conversations kept in memory, per process.
+    # Only safe with a single process writing chats (one worker, no other writer):
+    # chats saved elsewhere are not seen and leave gaps in the cached pages
+    RECENT_CACHE_ENABLED: bool = os.getenv('RECENT_CACHE_ENABLED', 'False').lower() == 'true'
+    RECENT_CACHE_MESSAGES: int = int(os.getenv('RECENT_CACHE_MESSAGES', 50))
+    RECENT_CACHE_CONVERSATIONS: int = int(os.getenv('RECENT_CACHE_CONVERSATIONS', 10000))
+    RECENT_CACHE_TTL: float = float(os.getenv('RECENT_CACHE_TTL', 5))
     DYNAMO_DB_TABLE: str = os.getenv('DYNAMO_DB_TABLE')
     AUTH_URI: str = os.getenv('AUTH_URI', "https://dvuysrcv6p.us-east-1.awsapprunner.com")
+    # Shared upstream HTTP client (pooled, keep-alive)
+    HTTP_MAX_CONNECTIONS: int = int(os.getenv('HTTP_MAX_CONNECTIONS', 100))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20))
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30.0))
+    HTTP_TIMEOUT: float = float(os.getenv('HTTP_TIMEOUT', 10.0))
+    HTTP_CONNECT_TIMEOUT: float = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5.0))
+    HTTP_POOL_TIMEOUT: float = float(os.getenv('HTTP_POOL_TIMEOUT', 5.0))
+    HTTP2: bool = os.getenv('HTTP2', 'True').lower() == 'true'
+    # Token -> user cache
+    AUTH_CACHE_TTL: float = float(os.getenv('AUTH_CACHE_TTL', 60))
+    AUTH_CACHE_NEGATIVE_TTL: float = float(os.getenv('AUTH_CACHE_NEGATIVE_TTL', 5))
+    AUTH_CACHE_MAX_SIZE: int = int(os.getenv('AUTH_CACHE_MAX_SIZE', 10000))
+    # Token verification: 'remote' asks AUTH_URI, 'local' checks the signature in-process
+    AUTH_MODE: Literal["remote", "local"] = os.getenv('AUTH_MODE', 'remote')
+    # Shared secret or PEM public key ('\\n' escapes allowed)
+    JWT_KEY: str = os.getenv('JWT_KEY', '').replace('\\n', '\n')
+    JWT_ALGORITHMS: list = os.getenv('JWT_ALGORITHMS', 'HS256').split(',')
+    JWT_ID_CLAIM: str = os.getenv('JWT_ID_CLAIM', 'id')
+    JWT_AUDIENCE: str = os.getenv('JWT_AUDIENCE')
+    JWT_ISSUER: str = os.getenv('JWT_ISSUER')
+    JWT_LEEWAY: float = float(os.getenv('JWT_LEEWAY', 0))
+    # Profile claims a token must carry to be trusted on its own, else the backend is asked
+    JWT_REQUIRED_CLAIMS: list = [claim for claim in os.getenv('JWT_REQUIRED_CLAIMS', 'full_name,profile_image').split(',') if claim]
+    # Cross-worker WebSocket delivery: 'memory' (single worker) or 'unix' (workers on one host)
+    WS_BROKER: Literal["memory", "unix"] = os.getenv('WS_BROKER', 'memory')
+    WS_BROKER_SOCKET_DIR: str = os.getenv('WS_BROKER_SOCKET_DIR', '/tmp/admrt-chat-broker')
+    # Seconds a single socket may take to accept a frame before it is dropped
+    WS_SEND_TIMEOUT: float = float(os.getenv('WS_SEND_TIMEOUT', 5.0))
+    # Outbound frames queued per socket, and what happens when a receiver falls behind:
+    # 'disconnect' it, or first drop ('drop_oldest') or replace ('coalesce') frames
+    # carrying no chat; chat frames are never dropped
+    WS_QUEUE_SIZE: int = int(os.getenv('WS_QUEUE_SIZE', 256))
+    WS_OVERFLOW_POLICY: Literal["disconnect", "drop_oldest", "coalesce"] = os.getenv('WS_OVERFLOW_POLICY', 'disconnect')
+    # Frames of one socket processed concurrently (same conversation stays in order)
+    WS_INFLIGHT_WINDOW: int = int(os.getenv('WS_INFLIGHT_WINDOW', 8))
+    # Messages per UNREAD-MESSAGES frame when replaying what a client missed offline.
+    # Only chats in the local database are replayed, in 'upstream' CHAT_WRITE_MODE
+    # the ones sent over the WebSocket live on the backend alone
+    WS_REPLAY_BATCH_SIZE: int = int(os.getenv('WS_REPLAY_BATCH_SIZE', 100))
+    # Delivered-marks are batched and flushed in the background
+    RECEIPT_FLUSH_INTERVAL: float = float(os.getenv('RECEIPT_FLUSH_INTERVAL_MS', 50)) / 1000
+    RECEIPT_BATCH_SIZE: int = int(os.getenv('RECEIPT_BATCH_SIZE', 100))
+    RECEIPT_MAX_ATTEMPTS: int = int(os.getenv('RECEIPT_MAX_ATTEMPTS', 5))
+    # Upstream endpoint accepting {"ids": [...]}, when unset every id is PATCHed on its own
+    RECEIPT_BULK_PATH: str = os.getenv('RECEIPT_BULK_PATH')
+    # 'upstream' POSTs every chat to the backend before delivering it, 'write_behind'
+    # saves it locally, delivers it and forwards it, and later its delivered-mark, to the
+    # backend in the background
+    CHAT_WRITE_MODE: Literal["upstream", "write_behind"] = os.getenv('CHAT_WRITE_MODE', 'upstream')
+    OUTBOX_FLUSH_INTERVAL: float = float(os.getenv('OUTBOX_FLUSH_INTERVAL_MS', 50)) / 1000
+    OUTBOX_BATCH_SIZE: int = int(os.getenv('OUTBOX_BATCH_SIZE', 100))
+    OUTBOX_MAX_BACKOFF: float = float(os.getenv('OUTBOX_MAX_BACKOFF', 60))
+    # Outbox entries failing this many times, or rejected with a 4xx, are dead-lettered
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+    # Upstream path accepting a list of chats in one request and answering with the
+    # created chats in the same order, if any
+    OUTBOX_BULK_PATH: str = os.getenv('OUTBOX_BULK_PATH')
 
     class Config:
         case_sensitive = True
@@ -1,10 +1,16 @@
 # import boto3
 # from boto3.dynamodb.conditions import Attr
-from sqlalchemy import create_engine
+import logging
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from api.config import settings
 from api.utils.logger import logger_config
+from api.utils.metrics import LatencyStats
 
 
 logger = logger_config(__name__)
@@ -12,18 +18,134 @@ logger = logger_config(__name__)
 # DYNAMO_DB_TABLE = boto3.resource('dynamodb').Table(settings.DYNAMO_DB_TABLE)
 # logger.info("DynamoDB has been connected")
 
-engine = create_engine(settings.DATABASE_URI, connect_args={"check_same_thread": False})
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+}
 
-# # If not sqlite3
-# engine = create_engine(DATABASE_URI)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def async_database_uri(uri: str):
+    '''
+    Swap a plain DATABASE_URI (also used by alembic) to its asyncio driver,
+    e.g. sqlite:///database.db -> sqlite+aiosqlite:///database.db
+    '''
+    scheme, separator, rest = uri.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.checkins = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.timeouts = 0
+        self.wait = LatencyStats()
+
+    def as_dict(self):
+        return {
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'in_use': self.in_use,
+            'peak_in_use': self.peak_in_use,
+            'timeouts': self.timeouts,
+            'wait': self.wait.as_dict(),
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection
+    """
+    def _do_get(self):
+        started = perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.wait.observe((perf_counter() - started) * 1000)
+
+
+# SQLAlchemy logs pool activity under the pool class' module, which is this
+# module's DEBUG logger, keep it to warnings
+logging.getLogger(f'{__name__}.{MeteredPool.__name__}').setLevel(logging.WARNING)
+
+
+def engine_options(uri: str):
+    is_sqlite = uri.startswith('sqlite')
+    if is_sqlite and (':memory:' in uri or uri.endswith('://')):
+        # One shared connection, there is nothing to pool
+        return {'poolclass': StaticPool}
+    options = {
+        'poolclass': MeteredPool,
+        'pool_size': settings.DB_POOL_SIZE,
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'pool_timeout': settings.DB_POOL_TIMEOUT,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+        'pool_pre_ping': settings.DB_POOL_PRE_PING,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        if is_sqlite:
+            # Closest SQLite has: how long to wait on a locked database
+            options['connect_args'] = {'timeout': settings.DB_STATEMENT_TIMEOUT_MS / 1000}
+        elif uri.startswith('postgresql+asyncpg'):
+            options['connect_args'] = {
+                'server_settings': {'statement_timeout': str(settings.DB_STATEMENT_TIMEOUT_MS)},
+            }
+    return options
+
+
+engine = create_async_engine(
+    async_database_uri(settings.DATABASE_URI),
+    **engine_options(async_database_uri(settings.DATABASE_URI)),
+)
+
+
+@event.listens_for(engine.sync_engine, 'connect')
+def on_connect(dbapi_connection, connection_record):
+    if engine.dialect.name == 'sqlite' and settings.DB_SQLITE_WAL:
+        # Readers don't block the writer, and fsync only at checkpoints
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
+@event.listens_for(engine.sync_engine, 'checkout')
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.checkouts += 1
+    pool_metrics.in_use += 1
+    pool_metrics.peak_in_use = max(pool_metrics.peak_in_use, pool_metrics.in_use)
+
+
+@event.listens_for(engine.sync_engine, 'checkin')
+def on_checkin(dbapi_connection, connection_record):
+    pool_metrics.checkins += 1
+    pool_metrics.in_use -= 1
+
+
+def pool_stats():
+    return {**pool_metrics.as_dict(), 'status': engine.pool.status()}
+
+
+def insert_ignore(db: AsyncSession, model):
+    '''
+    INSERT ... ON CONFLICT DO NOTHING in the session's dialect (postgresql or sqlite)
+    '''
+    dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model).on_conflict_do_nothing()
+
+
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
-def get_session():
-    db = SessionLocal()
-    try:
+async def get_session():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Table
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, Table, UniqueConstraint, false
 from sqlalchemy.orm import relationship
 from api.database import Base
 
@@ -7,7 +7,9 @@ user_conversation = Table(
     'user_conversation',
     Base.metadata,
     Column('user_id', ForeignKey('user.id'), primary_key=True),
-    Column('conversation_id', ForeignKey('conversation.id'), primary_key=True)
+    Column('conversation_id', ForeignKey('conversation.id'), primary_key=True),
+    # Messages of the conversation not yet delivered to this user
+    Column('unread_count', Integer, nullable=False, default=0, server_default='0'),
 )
 
 
@@ -28,6 +30,10 @@ class Conversation(Base):
     __tablename__ = 'conversation'
 
     id = Column(String, primary_key=True, index=True)
+    # Maintained by save_chat and update_as_delivered_in_bulk
+    message_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_message_id = Column(Integer, nullable=True)
+    last_activity_at = Column(Integer, nullable=True)
 
     users = relationship('User', secondary='user_conversation', back_populates='conversations')
 
@@ -46,10 +52,50 @@ class Chat(Base):
     text = Column(String)
     created_at = Column(Integer)
     delivered = Column(Boolean, default=False)
+    # Id of the chat on the upstream backend, once forwarded in write-behind mode
+    upstream_id = Column(Integer, nullable=True)
 
     sender = relationship('User', foreign_keys=[sender_id], backref='sent_chats')
     receiver = relationship('User', foreign_keys=[receiver_id], backref='received_chats')
     conversation = relationship('Conversation', backref='chats', foreign_keys=[conversation_id])
 
+    __table_args__ = (
+        # History pages, newest first
+        Index('ix_chat_conversation_id_id', conversation_id, id),
+        # History up to a timestamp
+        Index('ix_chat_conversation_id_created_at', conversation_id, created_at),
+        # Pending messages of a receiver, only undelivered rows are indexed
+        Index(
+            'ix_chat_receiver_id_undelivered',
+            receiver_id,
+            id,
+            sqlite_where=delivered == False,
+            postgresql_where=delivered == False,
+        ),
+    )
+
     def as_dict(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+class Outbox(Base):
+    '''
+    Chats saved locally in write-behind mode, and delivered-marks of those chats,
+    waiting to be forwarded upstream
+    '''
+    __tablename__ = 'chat_outbox'
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, ForeignKey('chat.id'), nullable=False)
+    sender_id = Column(String, nullable=False)
+    # 'chat' or 'delivered'
+    kind = Column(String, nullable=False, default='chat', server_default='chat')
+    attempts = Column(Integer, nullable=False, default=0, server_default='0')
+    # Rejected upstream or out of attempts, kept for inspection but no longer forwarded
+    dead_letter = Column(Boolean, nullable=False, default=False, server_default=false())
+
+    __table_args__ = (
+        UniqueConstraint(chat_id, kind),
+        # Oldest pending chats of a sender
+        Index('ix_chat_outbox_sender_id_id', sender_id, id),
+    )
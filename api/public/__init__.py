@@ -4,6 +4,7 @@ from api.auth import approve_jwt_token_for_http, approve_jwt_token_for_ws
 from api.config import settings
 # from api.public.health import views as health
 from api.public.chat import views as chat
+from api.public.stats import views as stats
 from api.public.user import views as user
 from api.public.ws import views as ws
 
@@ -28,6 +29,12 @@ api.include_router(
     tags=["Chat"],
     dependencies=[Depends(approve_jwt_token_for_http)],
 )
+api.include_router(
+    stats.router,
+    prefix="/stats",
+    tags=["Stats"],
+    dependencies=[Depends(approve_jwt_token_for_http)],
+)
 api.include_router(
     ws.router,
     prefix="/ws",
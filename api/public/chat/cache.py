@@ -0,0 +1,180 @@
+from bisect import insort
+from collections import OrderedDict, deque
+from time import monotonic
+from typing import Deque, Iterable, List, Optional
+
+from api.config import settings
+
+
+class RecentMessage:
+    '''
+    Compact copy of a chat row, kept instead of ORM instances
+    '''
+    __slots__ = ('id', 'sender_id', 'receiver_id', 'conversation_id', 'text', 'created_at', 'delivered')
+
+    def __init__(self, chat: dict):
+        for name in self.__slots__:
+            setattr(self, name, chat[name])
+
+    def __lt__(self, other: 'RecentMessage'):
+        return self.id < other.id
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ConversationBuffer:
+    '''
+    Ring buffer of the newest messages of a conversation, oldest first.
+    `complete` means no message of the conversation is older than the buffer,
+    `filled` that it was filled from the database and holds no gaps.
+    '''
+    __slots__ = ('messages', 'complete', 'filled', 'expires_at')
+
+    def __init__(self, size: int, expires_at: float, complete: bool = False, filled: bool = False):
+        self.messages: Deque[RecentMessage] = deque(maxlen=size)
+        self.complete = complete
+        self.filled = filled
+        self.expires_at = expires_at
+
+    def add(self, message: RecentMessage) -> bool:
+        '''
+        Returns True when the oldest message had to make room
+        '''
+        full = len(self.messages) == self.messages.maxlen
+        if not self.messages or self.messages[-1].id < message.id:
+            self.messages.append(message)
+        elif any(queued.id == message.id for queued in self.messages):
+            return False
+        else:
+            # Saved concurrently and committed out of order
+            messages = list(self.messages)
+            insort(messages, message)
+            self.messages.clear()
+            self.messages.extend(messages[-self.messages.maxlen:])
+        if full:
+            self.complete = False
+        return full
+
+
+class RecentMessageCache:
+    """
+    In-process LRU of per-conversation ring buffers holding the newest
+    `messages` chats, so the newest page of a thread is served without a query.
+    - Filled by the first read of a conversation and kept current by every chat
+      saved or marked delivered through this process. Chats saved before that
+      read are only held for it, pages are never served from them alone.
+    - Writes made by other processes are not seen and would leave gaps, so the
+      cache is only safe with a single process writing chats (RECENT_CACHE_ENABLED).
+      A buffer is dropped `ttl` seconds after it was filled to bound staleness.
+    - At most `max_conversations` buffers are kept, least recently used are evicted first.
+    """
+    def __init__(self, messages: int = 50, max_conversations: int = 10000, ttl: float = 5.0):
+        self.size = messages
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._buffers: 'OrderedDict[str, ConversationBuffer]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.overflows = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0 and self.max_conversations > 0 and self.ttl > 0
+
+    def _buffer(self, conversation_id: str) -> Optional[ConversationBuffer]:
+        buffer = self._buffers.get(conversation_id)
+        if buffer is not None and buffer.expires_at <= monotonic():
+            del self._buffers[conversation_id]
+            self.expired += 1
+            return None
+        return buffer
+
+    def page(self, conversation_id: str, limit: int) -> Optional[dict]:
+        '''
+        The newest page of a conversation in the shape of
+        fetch_single_conversation_upto_a_certain_time, None when it can't be served
+        '''
+        buffer = self._buffer(conversation_id) if self.enabled else None
+        if buffer is not None and buffer.filled:
+            newest = list(reversed(buffer.messages))[:limit + 1]
+            if len(newest) > limit or buffer.complete:
+                self._buffers.move_to_end(conversation_id)
+                self.hits += 1
+                return {
+                    "conversation": [message.as_dict() for message in newest[:limit]],
+                    "next_cursor": newest[limit - 1].id if len(newest) > limit else None,
+                }
+        self.misses += 1
+        return None
+
+    def store(self, conversation_id: str, chats: List[dict], complete: bool):
+        '''
+        Fill the buffer of a conversation from its newest chats, newest first
+        '''
+        if not self.enabled:
+            return
+        previous = self._buffer(conversation_id)
+        buffer = ConversationBuffer(self.size, monotonic() + self.ttl, complete, filled=True)
+        for chat in reversed(chats[:self.size]):
+            buffer.add(RecentMessage(chat))
+        if len(chats) > self.size:
+            buffer.complete = False
+        if previous is not None:
+            # Saved while the page was being read
+            for message in previous.messages:
+                buffer.add(message)
+        self._put(conversation_id, buffer)
+
+    def add(self, chat: dict):
+        if not self.enabled:
+            return
+        buffer = self._buffer(chat['conversation_id'])
+        if buffer is None:
+            # Kept for a read in flight, which may not see this chat yet
+            buffer = ConversationBuffer(self.size, monotonic() + self.ttl)
+            self._put(chat['conversation_id'], buffer)
+        if buffer.add(RecentMessage(chat)):
+            self.overflows += 1
+
+    def mark_delivered(self, conversation_id: str, chat_ids: Iterable[int]):
+        buffer = self._buffer(conversation_id) if self.enabled else None
+        if buffer is not None:
+            chat_ids = set(chat_ids)
+            for message in buffer.messages:
+                if message.id in chat_ids:
+                    message.delivered = True
+
+    def _put(self, conversation_id: str, buffer: ConversationBuffer):
+        self._buffers[conversation_id] = buffer
+        self._buffers.move_to_end(conversation_id)
+        while len(self._buffers) > self.max_conversations:
+            self._buffers.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, conversation_id: str):
+        self._buffers.pop(conversation_id, None)
+
+    def clear(self):
+        self._buffers.clear()
+
+    def stats(self):
+        return {
+            'conversations': len(self._buffers),
+            'messages': sum(len(buffer.messages) for buffer in self._buffers.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expired': self.expired,
+            'overflows': self.overflows,
+        }
+
+
+recent_messages = RecentMessageCache(
+    # Chats written by other processes would leave gaps in the buffers
+    messages=settings.RECENT_CACHE_MESSAGES if settings.RECENT_CACHE_ENABLED else 0,
+    max_conversations=settings.RECENT_CACHE_CONVERSATIONS,
+    ttl=settings.RECENT_CACHE_TTL,
+)
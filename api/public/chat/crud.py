@@ -1,13 +1,17 @@
-from typing import List, Optional, Union
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import Session
+from collections import Counter
+from typing import Dict, List, Optional, Union
+from sqlalchemy import and_, bindparam, case, delete, insert, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from api.config import settings
+from api.database import insert_ignore
 from api.database.models import Chat as ChatModel
 from api.database.models import User as UserModel
 from api.database.models import Conversation as ConversationModel
-from api.public.chat.schemas import ChatCreate, ChatOutput, ConversationCreate
-from api.public.user.crud import create_user_in_db
-from api.public.user.schemas import UserCreate
+from api.database.models import Outbox as OutboxModel
+from api.database.models import user_conversation
+from api.public.chat.cache import recent_messages
+from api.public.chat.schemas import ChatCreate, ChatRead, ConversationCreate
 from api.utils import generate_conversation_id
 from api.utils.logger import logger_config
 
@@ -15,115 +19,419 @@ from api.utils.logger import logger_config
 logger = logger_config(__name__)
 
 
-async def create_conversation(conversation: ConversationCreate, db: Session):
+async def create_conversation(conversation: ConversationCreate, db: AsyncSession):
     conv_to_db = ConversationModel(**conversation.model_dump())
     db.add(conv_to_db)
-    db.commit()
-    db.refresh(conv_to_db)
+    await db.commit()
+    await db.refresh(conv_to_db)
     return conv_to_db
 
 
-async def save_chat(chat: ChatCreate, db: Session):
-    conversation = db.query(ConversationModel).filter(ConversationModel.id==chat.conversation_id).first()
-    if conversation is None:
-        conversation = await create_conversation(ConversationCreate(id=chat.conversation_id), db)
-    sender = db.query(UserModel).filter(UserModel.id==chat.sender_id).first()
-    if sender is None:
-        sender = await create_user_in_db(UserCreate(id=chat.sender_id), db)
-    receiver = db.query(UserModel).filter(UserModel.id==chat.receiver_id).first()
-    if receiver is None:
-        receiver = await create_user_in_db(UserCreate(id=chat.receiver_id), db)
-    chat_to_db = ChatModel(
-        **chat.model_dump(),
-        conversation=conversation,
-        sender=sender,
-        receiver=receiver,
+async def count_new_chats(saved_chats: List[ChatModel], db: AsyncSession):
+    '''
+    Move the conversation counters (message count, last message, unread per receiver)
+    forward for freshly inserted chats, in the caller's transaction
+    '''
+    conversations = {}
+    unread = Counter()
+    for chat in saved_chats:
+        stats = conversations.get(chat.conversation_id)
+        if stats is None:
+            stats = conversations[chat.conversation_id] = {
+                'b_id': chat.conversation_id,
+                'b_count': 0,
+                'b_last_id': chat.id,
+                'b_last_at': chat.created_at,
+            }
+        stats['b_count'] += 1
+        if chat.id > stats['b_last_id']:
+            stats['b_last_id'] = chat.id
+            stats['b_last_at'] = chat.created_at
+        if not chat.delivered:
+            unread[(chat.receiver_id, chat.conversation_id)] += 1
+
+    conversation_table = ConversationModel.__table__
+    is_newer = or_(
+        conversation_table.c.last_message_id.is_(None),
+        conversation_table.c.last_message_id < bindparam('b_last_id'),
+    )
+    await db.execute(
+        conversation_table.update().where(
+            conversation_table.c.id==bindparam('b_id')
+        ).values(
+            message_count=conversation_table.c.message_count + bindparam('b_count'),
+            last_message_id=case((is_newer, bindparam('b_last_id')), else_=conversation_table.c.last_message_id),
+            last_activity_at=case((is_newer, bindparam('b_last_at')), else_=conversation_table.c.last_activity_at),
+        ),
+        list(conversations.values()),
+    )
+    await add_unread(unread, db)
+
+
+async def add_unread(unread: Counter, db: AsyncSession):
+    '''
+    Shift unread counts by {(user_id, conversation_id): delta}, never below zero
+    '''
+    if not unread:
+        return
+    unread_count = user_conversation.c.unread_count + bindparam('b_delta')
+    await db.execute(
+        user_conversation.update().where(
+            and_(
+                user_conversation.c.user_id==bindparam('b_user_id'),
+                user_conversation.c.conversation_id==bindparam('b_conversation_id'),
+            )
+        ).values(
+            unread_count=case((unread_count < 0, 0), else_=unread_count),
+        ),
+        [
+            {'b_user_id': user_id, 'b_conversation_id': conversation_id, 'b_delta': delta}
+            for (user_id, conversation_id), delta in unread.items()
+        ],
+    )
+
+
+async def save_chat(chat: ChatCreate, db: AsyncSession, outbox: bool = False):
+    '''
+    Save a chat in a single transaction, creating its users and conversation if missing.
+    With `outbox` the chat is also queued, in the same transaction, for forwarding upstream
+    '''
+    chat_to_db = chat.model_dump()
+    chat_to_db['receiver_id'] = str(chat.receiver_id)
+    await db.execute(
+        insert_ignore(db, UserModel).values([{'id': chat.sender_id}, {'id': chat_to_db['receiver_id']}])
+    )
+    await db.execute(
+        insert_ignore(db, ConversationModel).values(id=chat_to_db['conversation_id'])
+    )
+    await db.execute(
+        insert_ignore(db, user_conversation).values([
+            {'user_id': chat.sender_id, 'conversation_id': chat_to_db['conversation_id']},
+            {'user_id': chat_to_db['receiver_id'], 'conversation_id': chat_to_db['conversation_id']},
+        ])
+    )
+    saved_chat = await db.scalar(
+        insert(ChatModel).values(**chat_to_db).returning(ChatModel)
+    )
+    await count_new_chats([saved_chat], db)
+    if outbox:
+        await db.execute(
+            insert(OutboxModel).values(chat_id=saved_chat.id, sender_id=saved_chat.sender_id)
+        )
+    await db.commit()
+    recent_messages.add(saved_chat.as_dict())
+    return ChatRead(**saved_chat.as_dict())
+
+
+async def save_chats_in_bulk(chats: List[ChatCreate], db: AsyncSession, outbox: bool = False):
+    '''
+    Save many chats in a single transaction, creating all missing users and
+    conversations up front and inserting the chats as one executemany.
+    With `outbox` the chats are also queued, in the same transaction, for forwarding upstream
+    '''
+    if not chats:
+        return []
+    chats_to_db = []
+    user_ids = set()
+    conversation_ids = set()
+    memberships = set()
+    for chat in chats:
+        chat_to_db = chat.model_dump()
+        chat_to_db['receiver_id'] = str(chat.receiver_id)
+        chats_to_db.append(chat_to_db)
+        user_ids.update((chat_to_db['sender_id'], chat_to_db['receiver_id']))
+        conversation_ids.add(chat_to_db['conversation_id'])
+        memberships.add((chat_to_db['sender_id'], chat_to_db['conversation_id']))
+        memberships.add((chat_to_db['receiver_id'], chat_to_db['conversation_id']))
+    await db.execute(
+        insert_ignore(db, UserModel).values([{'id': user_id} for user_id in user_ids])
+    )
+    await db.execute(
+        insert_ignore(db, ConversationModel).values([{'id': conversation_id} for conversation_id in conversation_ids])
+    )
+    await db.execute(
+        insert_ignore(db, user_conversation).values([
+            {'user_id': user_id, 'conversation_id': conversation_id}
+            for user_id, conversation_id in memberships
+        ])
+    )
+    saved_chats = await db.scalars(
+        insert(ChatModel).returning(ChatModel, sort_by_parameter_order=True),
+        chats_to_db,
     )
-    db.add(chat_to_db)
-    db.commit()
-    db.refresh(chat_to_db)
-    return ChatOutput(**chat_to_db.as_dict())
+    saved_chats = saved_chats.all()
+    await count_new_chats(saved_chats, db)
+    if outbox:
+        await db.execute(
+            insert(OutboxModel),
+            [{'chat_id': saved_chat.id, 'sender_id': saved_chat.sender_id} for saved_chat in saved_chats],
+        )
+    await db.commit()
+    for saved_chat in saved_chats:
+        recent_messages.add(saved_chat.as_dict())
+    return [ChatRead(**saved_chat.as_dict()) for saved_chat in saved_chats]
 
 
 async def get_chats_by_conversation(
     user_id1: str,
     user_id2: str,
-    db: Session,
-    limit: int = 20,
+    db: AsyncSession,
+    limit: Optional[int] = None,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
 ):
-    conversation_id = generate_conversation_id(user_id1, user_id2)
-    conversation = db.query(ConversationModel).filter(
-        ConversationModel.id==conversation_id
-    ).limit(limit).first()
-    
-    return conversation.chats
+    return await fetch_single_conversation_upto_a_certain_time(
+        user_id1=user_id1,
+        user_id2=user_id2,
+        db=db,
+        before_id=before_id,
+        after_id=after_id,
+        limit=limit,
+    )
+
+
+async def fetch_undelivered_chats(
+    receiver_id: str,
+    db: AsyncSession,
+    after_id: int = 0,
+    limit: int = 100,
+):
+    '''
+    Next batch of chats not yet delivered to a user, oldest first, keyed on chat id
+    '''
+    chats = await db.scalars(
+        select(ChatModel).where(
+            and_(
+                ChatModel.receiver_id==receiver_id,
+                ChatModel.delivered==False,
+                ChatModel.id>after_id,
+            )
+        ).order_by(ChatModel.id).limit(limit)
+    )
+    return [chat.as_dict() for chat in chats]
+
+
+async def fetch_outbox(
+    sender_id: str,
+    db: AsyncSession,
+    limit: int = 100,
+):
+    '''
+    Oldest outbox entries of a sender still to be forwarded upstream, as (entry, chat)
+    '''
+    rows = await db.execute(
+        select(OutboxModel.id, OutboxModel.kind, OutboxModel.attempts, ChatModel).join(
+            ChatModel, ChatModel.id==OutboxModel.chat_id,
+        ).where(
+            and_(
+                OutboxModel.sender_id==sender_id,
+                OutboxModel.dead_letter==False,
+            )
+        ).order_by(OutboxModel.id).limit(limit)
+    )
+    return [
+        ({'id': outbox_id, 'kind': kind, 'attempts': attempts}, chat.as_dict())
+        for outbox_id, kind, attempts, chat in rows
+    ]
+
+
+async def fetch_outbox_senders(db: AsyncSession):
+    return set(await db.scalars(
+        select(OutboxModel.sender_id).where(OutboxModel.dead_letter==False).distinct()
+    ))
+
+
+async def settle_outbox(
+    done: List[int],
+    retried: List[int],
+    dead: List[int],
+    db: AsyncSession,
+):
+    '''
+    Drop forwarded outbox entries, count a failed attempt against retried ones
+    and dead-letter the rest
+    '''
+    if done:
+        await db.execute(delete(OutboxModel).where(OutboxModel.id.in_(done)))
+    if retried:
+        await db.execute(
+            update(OutboxModel).where(OutboxModel.id.in_(retried)).values(attempts=OutboxModel.attempts + 1)
+        )
+    if dead:
+        await db.execute(
+            update(OutboxModel).where(OutboxModel.id.in_(dead)).values(
+                attempts=OutboxModel.attempts + 1,
+                dead_letter=True,
+            )
+        )
+    await db.commit()
+
+
+async def set_upstream_ids(upstream_ids: Dict[int, int], db: AsyncSession):
+    '''
+    Remember the upstream ids of forwarded chats, to forward their delivered-marks later
+    '''
+    if upstream_ids:
+        chat_table = ChatModel.__table__
+        await db.execute(
+            chat_table.update().where(
+                chat_table.c.id==bindparam('b_id')
+            ).values(upstream_id=bindparam('b_upstream_id')),
+            [{'b_id': chat_id, 'b_upstream_id': upstream_id} for chat_id, upstream_id in upstream_ids.items()],
+        )
+        await db.commit()
 
 
 async def update_as_delivered_in_bulk(
     chat_ids: List[int],
-    db: Session,
+    db: AsyncSession,
+    outbox: bool = False,
 ):
-    db.bulk_update_mappings(
-        ChatModel,
-        [{'id': id, 'delivered': True} for id in chat_ids],
-    )
-    db.commit()
+    '''
+    With `outbox` the delivered-marks are also queued, in the same transaction,
+    for forwarding upstream
+    '''
+    # Only chats flipping to delivered here count against the unread counters
+    delivered_now = (await db.execute(
+        update(ChatModel).where(
+            and_(
+                ChatModel.id.in_(chat_ids),
+                ChatModel.delivered==False,
+            )
+        ).values(delivered=True).returning(ChatModel.id, ChatModel.receiver_id, ChatModel.conversation_id)
+    )).all()
+    unread = Counter()
+    conversations = {}
+    for chat_id, receiver_id, conversation_id in delivered_now:
+        unread[(receiver_id, conversation_id)] -= 1
+        conversations.setdefault(conversation_id, []).append(chat_id)
+    await add_unread(unread, db)
+    if outbox and delivered_now:
+        await db.execute(
+            insert_ignore(db, OutboxModel).from_select(
+                ['chat_id', 'sender_id', 'kind'],
+                select(ChatModel.id, ChatModel.sender_id, literal('delivered')).where(
+                    ChatModel.id.in_([chat_id for chat_id, _, _ in delivered_now])
+                ),
+            )
+        )
+    await db.commit()
+    for conversation_id, delivered_ids in conversations.items():
+        recent_messages.mark_delivered(conversation_id, delivered_ids)
     return True
 
 
 async def fetch_initial_conversations(
     user_id: str,
-    db: Session,
+    db: AsyncSession,
+    limit: Optional[int] = None,
+    offset: int = 0,
 ):
-    conversations = db.query(ConversationModel).filter(
-        or_(
-            ConversationModel.id.contains(f'{user_id}-'),
-            ConversationModel.id.contains(f'-{user_id}')
-        )
-    ).all()
-    resp_dict = {}
-    for conv in conversations:
-        users = conv.id.split('-')
-        users.remove(user_id)
-        user = db.query(UserModel).filter_by(id=users[0]).first()
-        new_messages = db.query(ChatModel).filter(
+    '''
+    Inbox summary of a user in a single query over the maintained conversation
+    counters: for every conversation the partner's profile, messages not yet
+    delivered to the user, the last message and its time, most recently active first.
+    `next_offset` asks for the following page, None on the last one
+    '''
+    limit = max(1, min(limit or settings.INBOX_PAGE_SIZE, settings.INBOX_PAGE_MAX_SIZE))
+    membership = user_conversation.alias('membership')
+    partnership = user_conversation.alias('partnership')
+    rows = await db.execute(
+        select(
+            membership.c.conversation_id,
+            UserModel,
+            membership.c.unread_count,
+            ChatModel,
+        ).select_from(membership).join(
+            partnership,
             and_(
-                ChatModel.conversation_id==conv.id,
-                ChatModel.delivered==False
-            )
-        ).count()
+                partnership.c.conversation_id==membership.c.conversation_id,
+                partnership.c.user_id!=membership.c.user_id,
+            ),
+        ).join(
+            UserModel, UserModel.id==partnership.c.user_id,
+        ).join(
+            ConversationModel, ConversationModel.id==membership.c.conversation_id,
+        ).outerjoin(
+            ChatModel, ChatModel.id==ConversationModel.last_message_id,
+        ).where(
+            membership.c.user_id==user_id,
+        ).order_by(
+            ConversationModel.last_activity_at.desc().nulls_last(),
+            membership.c.conversation_id,
+        # One row past the page tells whether there is a next one
+        ).limit(limit + 1).offset(offset)
+    )
+    rows = rows.all()
+    resp_dict = {}
+    for conversation_id, user, new_messages, last_message in rows[:limit]:
         user_dict = user.as_dict()
+        user_dict['conversation_id'] = conversation_id
         user_dict['unread_messages'] = new_messages
+        user_dict['last_message'] = last_message.as_dict() if last_message else None
+        user_dict['last_activity_at'] = last_message.created_at if last_message else None
         if user.id not in resp_dict:
             resp_dict[user.id] = [user_dict]
         else:
             resp_dict[user.id].append(user_dict)
-    return {"summary": resp_dict}
+    return {
+        "summary": resp_dict,
+        "next_offset": offset + limit if len(rows) > limit else None,
+    }
+
+
+def page_size(limit: Optional[int] = None) -> int:
+    if not limit:
+        return settings.CHAT_PAGE_SIZE
+    return max(1, min(limit, settings.CHAT_PAGE_MAX_SIZE))
 
 
 async def fetch_single_conversation_upto_a_certain_time(
     user_id1: str,
     user_id2: str,
-    db: Session,
+    db: AsyncSession,
     max_timestamp: Optional[Union[int, None]] = None,
-    limit: Optional[Union[int, None]] = 100,
+    limit: Optional[Union[int, None]] = None,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
 ):
+    '''
+    One page of a conversation, keyed on chat id so every page costs the same:
+    newest first, older than `before_id` (and not after `max_timestamp`) by default,
+    oldest first and newer than `after_id` when it is given.
+    `next_cursor` continues in the same direction, None on the last page
+    '''
+    if before_id is not None and after_id is not None:
+        raise ValueError('before_id and after_id are mutually exclusive')
+    limit = page_size(limit)
     conversation_id = generate_conversation_id(user_id1, user_id2)
-    if max_timestamp is not None:
-        chat_query = db.query(ChatModel).filter(
-            and_(
-                ChatModel.conversation_id==conversation_id,
-                ChatModel.created_at>=max_timestamp
-            )
-        ).order_by(ChatModel.id.desc())
+    newest_page = before_id is None and after_id is None and max_timestamp is None
+    if newest_page:
+        page = recent_messages.page(conversation_id, limit)
+        if page is not None:
+            return page
+    chat_query = select(ChatModel).where(ChatModel.conversation_id==conversation_id)
+    if after_id is not None:
+        chat_query = chat_query.where(ChatModel.id>after_id).order_by(ChatModel.id)
     else:
-        chat_query = db.query(ChatModel).filter(
-            and_(
-                ChatModel.conversation_id==conversation_id
-            )
-        ).order_by(ChatModel.id.desc())
-    chats = chat_query.limit(limit).all()
+        if before_id is not None:
+            chat_query = chat_query.where(ChatModel.id<before_id)
+        if max_timestamp is not None:
+            chat_query = chat_query.where(ChatModel.created_at<=max_timestamp)
+        chat_query = chat_query.order_by(ChatModel.id.desc())
+    # The newest page fills the whole recent buffer while at it
+    rows = max(limit, recent_messages.size) if newest_page and recent_messages.enabled else limit
+    # One row past the page tells whether there is a next one
+    chats = (await db.scalars(chat_query.limit(rows + 1))).all()
+    next_cursor = chats[limit - 1].id if len(chats) > limit else None
+    if newest_page:
+        recent_messages.store(
+            conversation_id,
+            [chat.as_dict() for chat in chats],
+            complete=len(chats) <= rows,
+        )
 
-    conversation = [chat.as_dict() for chat in chats]
-    
-    return conversation
+    return {
+        "conversation": [chat.as_dict() for chat in chats[:limit]],
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,64 @@
+"""
+Recompute the denormalized conversation counters from the chat table.
+
+    python -m api.public.chat.repair
+
+Safe to run at any time, e.g. after restoring data or a failed deploy.
+"""
+import asyncio
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.database import SessionLocal, engine
+from api.database.models import Chat as ChatModel
+from api.database.models import Conversation as ConversationModel
+from api.database.models import user_conversation
+from api.utils.logger import logger_config
+
+
+logger = logger_config(__name__)
+
+
+async def repair_conversation_counters(db: AsyncSession):
+    chat_table = ChatModel.__table__
+    conversation_table = ConversationModel.__table__
+    last_message_id = select(func.max(chat_table.c.id)).where(
+        chat_table.c.conversation_id==conversation_table.c.id
+    ).correlate(conversation_table).scalar_subquery()
+    conversations = await db.execute(
+        conversation_table.update().values(
+            message_count=select(func.count()).select_from(chat_table).where(
+                chat_table.c.conversation_id==conversation_table.c.id
+            ).scalar_subquery(),
+            last_message_id=last_message_id,
+            last_activity_at=select(chat_table.c.created_at).where(
+                chat_table.c.id==last_message_id
+            ).scalar_subquery(),
+        )
+    )
+    memberships = await db.execute(
+        user_conversation.update().values(
+            unread_count=select(func.count()).select_from(chat_table).where(
+                and_(
+                    chat_table.c.conversation_id==user_conversation.c.conversation_id,
+                    chat_table.c.receiver_id==user_conversation.c.user_id,
+                    chat_table.c.delivered==False,
+                )
+            ).scalar_subquery(),
+        )
+    )
+    await db.commit()
+    return {'conversations': conversations.rowcount, 'memberships': memberships.rowcount}
+
+
+async def main():
+    try:
+        async with SessionLocal() as db:
+            logger.info(f"Conversation counters repaired: {await repair_conversation_counters(db)}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
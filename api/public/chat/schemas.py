@@ -1,6 +1,6 @@
 from time import time_ns
 from typing import List, Optional, Union
-from pydantic import BaseModel, ValidationError, computed_field, field_validator
+from pydantic import BaseModel, Field, ValidationError, computed_field, field_validator
 
 from api.public.user.schemas import UserDBModel
 from api.utils import generate_conversation_id
@@ -44,13 +44,22 @@ class ChatInput(ChatBase):
         return int(value)
 
 
+class ChatBulkInput(ChatInput):
+    '''
+    Chat of a bulk upload, e.g. an offline outbox or an import,
+    keeping its original created_at when given
+    '''
+    created_at: Optional[int] = Field(None, ge=0)
+
+
 class ChatCreate(ChatInput):
     '''
     Create a complete chat combining sender_id,
-    generating conversation_id and adding created_at
+    generating conversation_id and adding created_at unless given
     '''
     sender_id: Union[str, int]
     delivered: Optional[bool] = False
+    created_at: int = Field(default_factory=lambda: time_ns() // 1000)
 
     @field_validator('sender_id')
     def convert_to_string(cls, value):
@@ -61,11 +70,6 @@ class ChatCreate(ChatInput):
     def conversation_id(self) -> str:
         return generate_conversation_id(self.sender_id, self.receiver_id)
     
-    @computed_field
-    @property
-    def created_at(self) -> int:
-        return time_ns() // 1000
-    
     # class Config:
     #     from_attributes: bool = True
     
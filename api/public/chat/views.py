@@ -1,15 +1,17 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.auth import approve_jwt_token_for_http
+from api.config import settings
 from api.database import get_session
-from api.public.chat.crud import get_chats_by_conversation, save_chat
-from api.public.chat.schemas import ChatCreate, ChatInput, ChatOutput
+from api.public.chat.crud import fetch_initial_conversations, get_chats_by_conversation, save_chat, save_chats_in_bulk
+from api.public.chat.schemas import ChatBulkInput, ChatCreate, ChatInput, ChatOutput
 from api.utils.logger import logger_config
 
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 logger = logger_config(__name__)
 
 
@@ -17,14 +19,38 @@ logger = logger_config(__name__)
 async def get_chats(
     partner_id: str,
     token: str = Depends(approve_jwt_token_for_http),
-    limit: Optional[int] = 20,
-    db: Session = Depends(get_session),
+    limit: Optional[int] = Query(None, ge=1, le=settings.CHAT_PAGE_MAX_SIZE),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_session),
 ):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either before_id or after_id, not both",
+        )
     return await get_chats_by_conversation(
         user_id1=partner_id,
         user_id2=str(token.get('id')),
         db=db,
         limit=limit,
+        before_id=before_id,
+        after_id=after_id,
+    )
+
+
+@router.get('/conversations', status_code=200)
+async def get_conversations(
+    token: str = Depends(approve_jwt_token_for_http),
+    limit: Optional[int] = Query(None, ge=1, le=settings.INBOX_PAGE_MAX_SIZE),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_session),
+):
+    return await fetch_initial_conversations(
+        user_id=str(token.get('id')),
+        db=db,
+        limit=limit,
+        offset=offset,
     )
 
 
@@ -32,9 +58,27 @@ async def get_chats(
 async def save_the_chat(
     chat: ChatInput,
     token: str = Depends(approve_jwt_token_for_http),
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_session),
 ):
     return await save_chat(
         chat=ChatCreate(sender_id=str(token.get('id')), **chat.model_dump()),
         db=db
     )
+
+
+@router.post('/bulk', status_code=201)
+async def save_chats(
+    chats: List[ChatBulkInput],
+    token: str = Depends(approve_jwt_token_for_http),
+    db: AsyncSession = Depends(get_session),
+):
+    if len(chats) > settings.CHAT_BULK_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.CHAT_BULK_MAX_SIZE} chats can be saved at once",
+        )
+    sender_id = str(token.get('id'))
+    return await save_chats_in_bulk(
+        chats=[ChatCreate(sender_id=sender_id, **chat.model_dump(exclude_none=True)) for chat in chats],
+        db=db,
+    )
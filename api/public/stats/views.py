@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+
+from api.auth import token_cache
+from api.database import pool_stats
+from api.public.chat.cache import recent_messages
+from api.public.ws.connection_manager import manager as connection_manager
+from api.utils.http_client import upstream
+
+
+router = APIRouter(default_response_class=ORJSONResponse)
+
+
+@router.get('', status_code=200)
+async def get_stats():
+    '''
+    Runtime metrics of this worker
+    '''
+    return {
+        "database": pool_stats(),
+        "upstream": upstream.metrics.snapshot(),
+        "token_cache": token_cache.stats(),
+        "recent_messages": recent_messages.stats(),
+        "websocket": connection_manager.outbound_stats(),
+        "receipts": connection_manager.receipts.stats(),
+        "outbox": connection_manager.forwarder.stats() if connection_manager.forwarder is not None else None,
+    }
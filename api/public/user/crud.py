@@ -1,4 +1,5 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
 from api.database.models import User as UserModel
@@ -11,35 +12,35 @@ logger = logger_config(__name__)
 
 async def create_user_in_db(
     user: UserCreate,
-    db: Session,
+    db: AsyncSession,
 ):
     try:
         user_to_db = UserModel(**user.model_dump())
         db.add(user_to_db)
-        db.commit()
-        db.refresh(user_to_db)
+        await db.commit()
+        await db.refresh(user_to_db)
         # return UserRead(**user_to_db.as_dict())
         return user_to_db
     except IntegrityError:
+        await db.rollback()
         return None
 
 
 async def get_user_from_db(
     user_id: str,
-    db: Session,
+    db: AsyncSession,
 ):
-    query_result = db.query(UserModel).filter(UserModel.id==user_id).first()
+    query_result = await db.get(UserModel, user_id)
     if query_result:
-        print(query_result.conversations)
         return UserRead(**query_result.as_dict())
     return None
 
 
 async def update_user_info(
     user: UserUpdate,
-    db: Session,
+    db: AsyncSession,
 ):
-    q = db.query(UserModel).filter_by(id=user.id).first()
+    q = await db.get(UserModel, user.id)
     if q is None:
         return await create_user_in_db(user, db)
     else:
@@ -51,9 +52,10 @@ async def update_user_info(
                 should_update = True
                 setattr(user_to_be_updated, key, getattr(user, key))
         if should_update:
-            db.bulk_update_mappings(
-                UserModel,
-                [user_to_be_updated.model_dump().items()]
+            await db.execute(
+                update(UserModel).where(UserModel.id==user.id).values(
+                    **user_to_be_updated.model_dump(exclude={'id'}, exclude_unset=True)
+                )
             )
-            db.commit()
+            await db.commit()
         return user
@@ -1,6 +1,6 @@
 from typing import List, Optional
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from api.auth import approve_jwt_token_for_http
 from api.database import get_session
@@ -16,7 +16,7 @@ logger = logger_config(__name__)
 @router.get('')
 async def get_user(
     id: str,
-    db: Session = Depends(get_session)
+    db: AsyncSession = Depends(get_session)
 ):
     return await get_user_from_db(id, db)
 
@@ -24,6 +24,6 @@ async def get_user(
 @router.post('')
 async def create_user(
     user: UserCreate,
-    db: Session = Depends(get_session)
+    db: AsyncSession = Depends(get_session)
 ):
     return await create_user_in_db(user, db)
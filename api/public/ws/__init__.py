@@ -2,6 +2,7 @@
 SEND = 'SEND'
 FETCH = 'FETCH'
 MESSAGE = 'MESSAGE'
+MESSAGES = 'MESSAGES'
 CONVERSATION = 'CONVERSATION'
 NEW = 'NEW'
 UNREAD = 'UNREAD'
@@ -11,15 +12,21 @@ ERROR = 'ERROR'
 # Composit Action Words
 class AllowedActions:
     SEND_MESSAGE = f"{SEND}-{MESSAGE}" # client requests for sending a message
+    SEND_MESSAGES = f"{SEND}-{MESSAGES}" # client requests for sending many messages at once, e.g. its offline outbox
     FETCH_CONVERSATION = f"{FETCH}-{CONVERSATION}" # client requests for a conversation
+    FETCH_CONVERSATION_LIST = f"{FETCH}-{CONVERSATION}-{LIST}" # client requests for a further page of its inbox
     # for server only
     NEW_MESSAGE = f"{NEW}-{MESSAGE}" # action to be taken after processing 'SEND-MESSAGE'
     CONVERSATION = CONVERSATION # action to be taken after processing 'FETCH-CONVERSATION'
     UNREAD_CONVERSATION = f"{CONVERSATION}-{LIST}" # when a client is connected, server automatically does this action
+    UNREAD_MESSAGES = f"{UNREAD}-{MESSAGES}" # then replays, in batches, the messages it missed while offline
     ERROR = ERROR
 
     def __init__(self):
-        self.all_actions = [action for action in AllowedActions.__dict__.values() if isinstance(action, str)]
+        self.all_actions = frozenset(
+            action for key, action in AllowedActions.__dict__.items()
+            if not key.startswith('_') and isinstance(action, str)
+        )
 
 
 ALLOWED_ACTIONS = AllowedActions()
@@ -0,0 +1,47 @@
+from typing import Annotated, Awaitable, Callable, Dict, Type, Union
+from pydantic import Discriminator, Tag, TypeAdapter
+
+from api.public.ws.schemas import InboundFrame
+
+
+Handler = Callable[..., Awaitable[None]]
+
+
+def _frame_action(value):
+    # Matches InboundFrame.upper_case_action, so the tag lookup is case insensitive too
+    action = value.get('action') if isinstance(value, dict) else getattr(value, 'action', None)
+    return action.upper() if isinstance(action, str) else action
+
+
+class ActionRegistry:
+    """
+    Dispatch table of client actions: action -> (frame schema, handler).
+    Handlers register with the `register` decorator, `build` then compiles a single
+    discriminated union adapter so a raw frame is validated in one `validate_json` pass.
+    """
+    def __init__(self):
+        self.frames: Dict[str, Type[InboundFrame]] = {}
+        self.handlers: Dict[str, Handler] = {}
+        self.adapter = None
+
+    def register(self, action: str, frame: Type[InboundFrame]):
+        def decorator(handler: Handler):
+            self.frames[action] = frame
+            self.handlers[action] = handler
+            return handler
+        return decorator
+
+    def build(self):
+        members = [Annotated[frame, Tag(action)] for action, frame in self.frames.items()]
+        if len(members) == 1:
+            # A union of one is the frame itself, its Literal action does the checking
+            self.adapter = TypeAdapter(members[0])
+        else:
+            self.adapter = TypeAdapter(Annotated[Union[tuple(members)], Discriminator(_frame_action)])
+        return self
+
+    def validate_json(self, message: Union[str, bytes]) -> InboundFrame:
+        return self.adapter.validate_json(message)
+
+    def handler(self, action: str) -> Handler:
+        return self.handlers[action]
@@ -0,0 +1,171 @@
+import asyncio
+import glob
+import os
+import struct
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from api.utils.logger import logger_config
+from api.utils.serialization import dumps_bytes, loads
+
+
+logger = logger_config(__name__)
+
+
+# (token, chat_id) to mark the chat delivered with, once a socket was sent the payload
+Receipt = Tuple[str, int]
+
+# (client_id, payload, receipt) -> whether a socket of that client accepted it
+DeliverCallback = Callable[[str, str, Optional[Receipt]], Awaitable[bool]]
+
+
+class Broker:
+    """
+    Routes deliveries to the other workers serving WebSocket connections.
+    The local worker is always tried by ConnectionManager itself, a broker
+    only has to reach its peers.
+    """
+    async def start(self, deliver: DeliverCallback):
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, client_id: str, payload: str, receipt: Optional[Receipt] = None) -> bool:
+        '''
+        Offer the payload to every peer, True if any of them accepted it.
+        The peer that actually sends it marks the receipt.
+        '''
+        return False
+
+
+class InMemoryBroker(Broker):
+    """
+    Brokers sharing the same hub reach each other in-process.
+    With the default private hub it is a no-op, i.e. single worker mode.
+    """
+    def __init__(self, hub: Optional[List['InMemoryBroker']] = None):
+        self.hub = hub if hub is not None else []
+
+    async def start(self, deliver: DeliverCallback):
+        await super().start(deliver)
+        self.hub.append(self)
+
+    async def stop(self):
+        if self in self.hub:
+            self.hub.remove(self)
+
+    async def publish(self, client_id: str, payload: str, receipt: Optional[Receipt] = None) -> bool:
+        peers = [broker for broker in self.hub if broker is not self]
+        if not peers:
+            return False
+        results = await asyncio.gather(*[peer.deliver(client_id, payload, receipt) for peer in peers])
+        return any(results)
+
+
+_HEADER = struct.Struct('!I')
+DELIVERED = b'\x01'
+NOT_DELIVERED = b'\x00'
+
+
+class UnixSocketBroker(Broker):
+    """
+    One Unix domain socket per worker in a shared directory.
+    Publishing sends a length-prefixed frame to every peer socket over a
+    persistent connection; each peer answers with a single accepted byte.
+    Sockets of dead workers are removed on the first refused connection.
+    """
+    def __init__(self, socket_dir: str, timeout: float = 2.0):
+        self.socket_dir = socket_dir
+        self.timeout = timeout
+        self.path = os.path.join(socket_dir, f'{os.getpid()}.sock')
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Dict[str, Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def start(self, deliver: DeliverCallback):
+        await super().start(deliver)
+        os.makedirs(self.socket_dir, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+        logger.info(f"broker: listening on {self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for _, writer in self._peers.values():
+            writer.close()
+        self._peers.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                message = loads(frame)
+                receipt = message.get('r')
+                delivered = await self.deliver(message['c'], message['p'], tuple(receipt) if receipt else None)
+                writer.write(DELIVERED if delivered else NOT_DELIVERED)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def peer_paths(self) -> List[str]:
+        return [
+            path for path in glob.glob(os.path.join(self.socket_dir, '*.sock'))
+            if path != self.path
+        ]
+
+    async def publish(self, client_id: str, payload: str, receipt: Optional[Receipt] = None) -> bool:
+        peers = self.peer_paths()
+        if not peers:
+            return False
+        frame = dumps_bytes({'c': client_id, 'p': payload, 'r': receipt})
+        results = await asyncio.gather(*[self._send(path, frame) for path in peers])
+        return any(results)
+
+    async def _send(self, path: str, frame: bytes) -> bool:
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            try:
+                reader, writer = await self._connection(path)
+                writer.write(_HEADER.pack(len(frame)) + frame)
+                await writer.drain()
+                return await asyncio.wait_for(reader.readexactly(1), self.timeout) == DELIVERED
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker behind this socket is gone
+                self._drop(path)
+                if os.path.exists(path):
+                    os.unlink(path)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+                logger.info(f"broker: peer {path} failed: {e!r}")
+                self._drop(path)
+        return False
+
+    async def _connection(self, path: str):
+        connection = self._peers.get(path)
+        if connection is None or connection[1].is_closing():
+            connection = await asyncio.wait_for(asyncio.open_unix_connection(path), self.timeout)
+            self._peers[path] = connection
+        return connection
+
+    def _drop(self, path: str):
+        connection = self._peers.pop(path, None)
+        if connection is not None:
+            connection[1].close()
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return await reader.readexactly(size)
+
+
+def create_broker(backend: str, socket_dir: str) -> Broker:
+    if backend == 'unix':
+        return UnixSocketBroker(socket_dir)
+    return InMemoryBroker()
@@ -1,16 +1,26 @@
-import json
-from json.decoder import JSONDecodeError
-from typing import List, Optional, Union
+import asyncio
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 from fastapi import WebSocket
-from pydantic import BaseModel, TypeAdapter, ValidationError
+from pydantic import BaseModel, ValidationError
 # import traceback
 
 from api.auth import get_user
 from api.config import settings
+from api.database import SessionLocal
+from api.public.chat.crud import fetch_initial_conversations, fetch_single_conversation_upto_a_certain_time, fetch_undelivered_chats, save_chat, save_chats_in_bulk, update_as_delivered_in_bulk
+from api.public.chat.schemas import ChatCreate
 from api.public.ws import ALLOWED_ACTIONS
-from api.public.ws.schemas import ConversationObject, ErrorNotification, FetchConversationRequest, SendMessageRequest, WSObject
+from api.public.ws.actions import ActionRegistry
+from api.public.ws.broker import Broker, InMemoryBroker, Receipt, create_broker
+from api.public.ws.forwarder import FORWARDED, REJECTED, RETRY, UNAUTHORIZED, ForwardResult, OutboxForwarder, upstream_outcome
+from api.public.ws.outbound import OutboundChannel, OverflowPolicy
+from api.public.ws.pipeline import InboundPipeline
+from api.public.ws.receipts import DeliveryReceiptBatcher
+from api.public.ws.registry import Connection, ConnectionRegistry
+from api.public.ws.schemas import ConversationObject, ErrorNotification, FetchConversationFrame, FetchConversationListFrame, FetchConversationRequest, InboundFrame, SendMessageFrame, SendMessageRequest, SendMessagesFrame, UnreadMessagesDistribution, WSObject
+from api.utils.http_client import upstream
 from api.utils.logger import logger_config
-import httpx
+from api.utils.serialization import dump_model, text_size
 
 
 logger = logger_config(__name__)
@@ -53,16 +63,9 @@ HEADER_KEY = 'Authorization'
 
 async def send_chat_message(token: str, msg: dict):
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                url=f"{settings.AUTH_URI}/chat/",
-                headers={
-                    HEADER_KEY: 'JWT ' + token
-                },
-                json=msg
-            )
-            if resp.status_code == 201:
-                return resp.json()
+        resp = await upstream.request('POST', '/chat/', token=token, json=msg)
+        if resp.status_code == 201:
+            return resp.json()
     except Exception as e:
         print(e)
     return None
@@ -70,21 +73,192 @@ async def send_chat_message(token: str, msg: dict):
 
 async def mark_message_as_delivered(token: str, chat_id: int):
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.patch(
-                url=f"{settings.AUTH_URI}/chat/{chat_id}/",
-                headers={
-                    HEADER_KEY: 'JWT ' + token
-                },
-                json={"delivered": True}
-            )
-            if resp.status_code == 200:
-                return resp.json()
+        resp = await upstream.request(
+            'PATCH',
+            f'/chat/{chat_id}/',
+            token=token,
+            metric='/chat/{id}/',
+            json={"delivered": True},
+        )
+        if resp.status_code == 200:
+            return resp.json()
     except Exception as e:
         print(e)
     return None
 
 
+async def mark_messages_as_delivered(token: str, chat_ids: List[int]) -> List[int]:
+    '''
+    Mark a batch of chats as delivered upstream, returns the ids that failed
+    '''
+    if settings.RECEIPT_BULK_PATH:
+        try:
+            resp = await upstream.request(
+                'POST',
+                settings.RECEIPT_BULK_PATH,
+                token=token,
+                json={"ids": chat_ids},
+            )
+            if resp.status_code in (200, 204):
+                return []
+        except Exception as e:
+            logger.info(f"Bulk delivery receipts failed: {e!r}")
+        return chat_ids
+    results = await asyncio.gather(*[mark_message_as_delivered(token, chat_id) for chat_id in chat_ids])
+    return [chat_id for chat_id, result in zip(chat_ids, results) if result is None]
+
+
+async def mark_messages_as_delivered_locally(token: str, chat_ids: List[int]) -> List[int]:
+    '''
+    Delivered-marks in write-behind mode, the chats live in the local database
+    and the marks are queued for the forwarder
+    '''
+    async with SessionLocal() as db:
+        await update_as_delivered_in_bulk(chat_ids, db, outbox=True)
+    return []
+
+
+def upstream_chat(chat: dict) -> dict:
+    return {
+        "receiver_id": int(chat['receiver_id']),
+        "text": chat['text'],
+        "created_at": chat['created_at'],
+        "delivered": chat['delivered'],
+    }
+
+
+async def forward_chat(token: str, chat: dict) -> Tuple[str, Optional[int]]:
+    '''
+    POST one locally saved chat upstream, returns the outcome and the upstream id
+    '''
+    try:
+        resp = await upstream.request('POST', '/chat/', token=token, json=upstream_chat(chat))
+    except Exception as e:
+        logger.info(f"Forwarding chat {chat['id']} failed: {e!r}")
+        return RETRY, None
+    outcome = upstream_outcome(resp.status_code)
+    if outcome != FORWARDED:
+        return outcome, None
+    try:
+        return outcome, resp.json().get('id')
+    except Exception:
+        return outcome, None
+
+
+async def forward_chat_messages(token: str, chats: List[dict]) -> ForwardResult:
+    '''
+    Replicate locally saved chats upstream.
+    Every conversation is forwarded in order and stops at its first failure,
+    a rejected chat is skipped so it doesn't hold back the ones after it
+    '''
+    result = ForwardResult()
+    if settings.OUTBOX_BULK_PATH:
+        try:
+            resp = await upstream.request(
+                'POST',
+                settings.OUTBOX_BULK_PATH,
+                token=token,
+                json=[upstream_chat(chat) for chat in chats],
+            )
+            outcome = upstream_outcome(resp.status_code)
+        except Exception as e:
+            logger.info(f"Bulk forwarding of chats failed: {e!r}")
+            outcome = RETRY
+        if outcome == FORWARDED:
+            try:
+                created = resp.json()
+            except Exception:
+                created = None
+            if not isinstance(created, list) or len(created) != len(chats):
+                created = [None] * len(chats)
+            for chat, created_chat in zip(chats, created):
+                result.forwarded[chat['id']] = created_chat.get('id') if isinstance(created_chat, dict) else None
+            return result
+        if outcome == UNAUTHORIZED:
+            result.unauthorized = True
+            return result
+        if outcome == RETRY:
+            result.retry.update(chat['id'] for chat in chats)
+            return result
+        # Some chat of the batch was refused, find out which one by one
+    conversations: Dict[str, List[dict]] = {}
+    for chat in chats:
+        conversations.setdefault(chat['conversation_id'], []).append(chat)
+
+    async def forward_in_order(chats: List[dict]):
+        for chat in chats:
+            if result.unauthorized:
+                return
+            outcome, upstream_id = await forward_chat(token, chat)
+            if outcome == FORWARDED:
+                result.forwarded[chat['id']] = upstream_id
+            elif outcome == REJECTED:
+                result.rejected.add(chat['id'])
+            elif outcome == UNAUTHORIZED:
+                result.unauthorized = True
+                return
+            else:
+                result.retry.add(chat['id'])
+                return
+
+    await asyncio.gather(*[forward_in_order(chats) for chats in conversations.values()])
+    return result
+
+
+async def forward_delivered_mark(token: str, chat: dict) -> str:
+    try:
+        resp = await upstream.request(
+            'PATCH',
+            f"/chat/{chat['upstream_id']}/",
+            token=token,
+            metric='/chat/{id}/',
+            json={"delivered": True},
+        )
+    except Exception as e:
+        logger.info(f"Forwarding the delivered-mark of chat {chat['id']} failed: {e!r}")
+        return RETRY
+    return upstream_outcome(resp.status_code)
+
+
+async def forward_delivered_marks(token: str, chats: List[dict]) -> ForwardResult:
+    '''
+    Replicate local delivered-marks of already forwarded chats upstream
+    '''
+    result = ForwardResult()
+    if settings.RECEIPT_BULK_PATH:
+        try:
+            resp = await upstream.request(
+                'POST',
+                settings.RECEIPT_BULK_PATH,
+                token=token,
+                json={"ids": [chat['upstream_id'] for chat in chats]},
+            )
+            outcome = upstream_outcome(resp.status_code)
+        except Exception as e:
+            logger.info(f"Bulk forwarding of delivered-marks failed: {e!r}")
+            outcome = RETRY
+        if outcome != REJECTED:
+            if outcome == FORWARDED:
+                result.forwarded.update((chat['id'], None) for chat in chats)
+            elif outcome == UNAUTHORIZED:
+                result.unauthorized = True
+            else:
+                result.retry.update(chat['id'] for chat in chats)
+            return result
+        # Some mark of the batch was refused, find out which one by one
+    outcomes = await asyncio.gather(*[forward_delivered_mark(token, chat) for chat in chats])
+    for chat, outcome in zip(chats, outcomes):
+        if outcome == FORWARDED:
+            result.forwarded[chat['id']] = None
+        elif outcome == REJECTED:
+            result.rejected.add(chat['id'])
+        elif outcome == UNAUTHORIZED:
+            result.unauthorized = True
+        else:
+            result.retry.add(chat['id'])
+    return result
+
+
 # async def mark_conversation_as_delivered(token: str, partner_id: int):
 #     try:
 #         async with httpx.AsyncClient() as client:
@@ -107,56 +281,278 @@ async def mark_message_as_delivered(token: str, chat_id: int):
 #     return True
 
 
+actions = ActionRegistry()
+
+
+class DeliveryReport:
+    """
+    Outcome of ConnectionManager.notify_client.
+    `sockets` maps each local socket of the client to whether the frame was queued
+    for it, `remote` tells whether another worker accepted it. Truthy if anyone did.
+    Queued is not sent yet, a receipt is only marked once a socket sent the frame.
+    """
+    __slots__ = ('sockets', 'remote')
+
+    def __init__(self, sockets: Dict[WebSocket, bool], remote: bool = False):
+        self.sockets = sockets
+        self.remote = remote
+
+    @property
+    def delivered(self):
+        return self.remote or any(self.sockets.values())
+
+    def __bool__(self):
+        return self.delivered
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict = {}
+    def __init__(
+        self,
+        broker: Optional[Broker] = None,
+        send_timeout: float = 5.0,
+        queue_size: int = 256,
+        overflow_policy: str = OverflowPolicy.DISCONNECT,
+        receipts: Optional[DeliveryReceiptBatcher] = None,
+        replay_batch_size: int = 100,
+        forwarder: Optional[OutboxForwarder] = None,
+    ):
+        self.connections = ConnectionRegistry()
+        self.broker = broker if broker is not None else InMemoryBroker()
+        self.send_timeout = send_timeout
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.replay_batch_size = replay_batch_size
+        # Set in write-behind mode, chats are then saved locally and forwarded later
+        self.forwarder = forwarder
+        self.receipts = receipts if receipts is not None else DeliveryReceiptBatcher(mark_messages_as_delivered)
+
+    async def start(self):
+        await self.broker.start(self.deliver_from_peer)
+        await self.receipts.start()
+        if self.forwarder is not None:
+            await self.forwarder.start()
+
+    async def stop(self):
+        await self.receipts.stop()
+        if self.forwarder is not None:
+            await self.forwarder.stop()
+        await self.broker.stop()
+        for connection in self.connections:
+            connection.channel.close()
+        self.connections.clear()
     
     async def connect(self, websocket: WebSocket, token: str):
         try:
             # Check the user
             user_data = await get_user(token)
             if user_data and user_data.get('id') is not None:
-                # If valid, accept the connection first
-                await websocket.accept()
                 client_id = str(user_data.get('id'))
-                if client_id in self.active_connections:
-                    # If connection id is present, just append new connection
-                    self.active_connections[client_id].append(websocket)
-                else:
-                    # create new key with a list containing the new connection
-                    self.active_connections[client_id] = [websocket]
+                if self.forwarder is not None:
+                    # Outbox chats left from before a restart can be forwarded again
+                    self.forwarder.remember(client_id, token)
+                # Load the inbox while the handshake completes
+                inbox = asyncio.ensure_future(self.load_inbox(client_id))
+                try:
+                    # If valid, accept the connection first
+                    await websocket.accept()
+                except Exception:
+                    inbox.cancel()
+                    raise
+                connection = Connection(websocket, client_id)
+                # Frames for this socket queue up until it has caught up
+                connection.channel = OutboundChannel(
+                    websocket,
+                    on_failure=lambda: self.evict(client_id, websocket),
+                    max_size=self.queue_size,
+                    policy=self.overflow_policy,
+                    send_timeout=self.send_timeout,
+                    on_sent=connection.sent,
+                )
+                # Registered before the replay so nothing sent meanwhile is missed,
+                # but held back until it is over
+                connection.held = []
+                # A single person can be connected from multiple devices
+                self.connections.add(connection)
+                inbox_frame = await inbox
+                try:
+                    # The inbox is the first frame of every connection, then what was missed offline
+                    if inbox_frame is not None:
+                        await self.send_now(websocket, inbox_frame)
+                    replayed = await self.replay_undelivered(client_id, websocket)
+                except Exception:
+                    self.disconnect(client_id, websocket)
+                    raise
+                held, connection.held = connection.held, None
+                for payload, on_delivered, chat_id in held:
+                    # Saved during the replay and already part of it
+                    if chat_id is not None and chat_id in replayed:
+                        continue
+                    connection.channel.put(payload, on_delivered)
+                connection.channel.start()
                 return client_id
         except Exception:
             pass
         return None
+
+    async def load_inbox(self, client_id: str) -> Optional[WSObject]:
+        try:
+            async with SessionLocal() as db:
+                summary = await fetch_initial_conversations(client_id, db)
+            return WSObject(
+                action=ALLOWED_ACTIONS.UNREAD_CONVERSATION,
+                body=summary,
+            )
+        except Exception as e:
+            # Clients can still fetch it themselves, don't refuse the connection
+            logger.error(f"Could not load the inbox of client {client_id}: {e}")
+            return None
     
+    async def send_now(self, websocket: WebSocket, message: BaseModel):
+        payload = dump_model(message)
+        await asyncio.wait_for(websocket.send_text(payload), self.send_timeout)
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.sent(text_size(payload))
+
+    async def replay_undelivered(self, client_id: str, websocket: WebSocket) -> Set[int]:
+        '''
+        Stream the messages a client missed while offline, oldest first and in batches
+        of `replay_batch_size`, each batch marked delivered once it is sent.
+        Returns the ids replayed.
+        Only chats in the local database are replayed: in the default upstream
+        write mode, chats sent over the WebSocket are stored by the backend alone
+        and a client has to fetch what it missed from there.
+        '''
+        replayed: Set[int] = set()
+        last_id = 0
+        async with SessionLocal() as db:
+            while True:
+                chats = await fetch_undelivered_chats(client_id, db, after_id=last_id, limit=self.replay_batch_size)
+                if not chats:
+                    return replayed
+                await self.send_now(
+                    websocket,
+                    WSObject(
+                        action=ALLOWED_ACTIONS.UNREAD_MESSAGES,
+                        body=UnreadMessagesDistribution(messages=chats),
+                    ),
+                )
+                await update_as_delivered_in_bulk(
+                    [chat['id'] for chat in chats],
+                    db,
+                    outbox=self.forwarder is not None,
+                )
+                replayed.update(chat['id'] for chat in chats)
+                if len(chats) < self.replay_batch_size:
+                    return replayed
+                last_id = chats[-1]['id']
+
     def disconnect(self, client_id: str, websocket: WebSocket):
-        # check if the id is in the keys
-        if client_id in self.active_connections:
-            # Loop through the ids and delete whichever connection matches
-            # Because single person can be connected from multiple devices
-            for websocket_conection in self.active_connections[client_id]:
-                if websocket_conection == websocket:
-                    self.active_connections[client_id].remove(websocket_conection)
-            # If no connections exist in that key, delete the key
-            if len(self.active_connections[client_id]) == 0:
-                del self.active_connections[client_id]
+        connection = self.connections.remove(websocket)
+        if connection is not None:
+            connection.channel.close()
             return True
-        # else attempted to delete such a connection which was not there
-        # something unusual
+        # else attempted to delete such a connection which was not there,
+        # e.g. already evicted
         logger.info(f"Attempted to disconnect a websocket connection from client {client_id}, which was not found on existing websocket list.")
         return False
 
-    async def notify_client(self, client_id: Union[str, int], message: BaseModel):
+    def received(self, websocket: WebSocket, size: int):
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.received(size)
+
+    def evict(self, client_id: str, websocket: WebSocket):
+        # Failed, too slow or overflowing socket, stop queueing for it and close it
+        logger.info(f"Evicting websocket connection of client {client_id}")
+        self.disconnect(client_id, websocket)
+        asyncio.ensure_future(self._close_socket(websocket))
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), self.send_timeout)
+        except Exception:
+            pass
+
+    def deliver_local(
+        self,
+        client_id: str,
+        payload: str,
+        receipt: Optional[Receipt] = None,
+    ) -> Dict[WebSocket, bool]:
+        # A single person can be connected from multiple devices, queue for each
+        # of them, their writer tasks send concurrently
+        on_delivered = self.receipt_marker(receipt)
+        chat_id = receipt[1] if receipt is not None else None
+        queued = {}
+        for connection in self.connections.of_user(client_id):
+            if connection.held is not None:
+                connection.held.append((payload, on_delivered, chat_id))
+                queued[connection.websocket] = True
+            else:
+                queued[connection.websocket] = connection.channel.put(payload, on_delivered)
+        return queued
+
+    def receipt_marker(self, receipt: Optional[Receipt]) -> Optional[Callable[[], None]]:
+        if receipt is None:
+            return None
+        token, chat_id = receipt
+        # Mark as delivered in database, in the next batch
+        return lambda: self.receipts.add(token, chat_id)
+
+    def outbound_stats(self):
+        connections = list(self.connections)
+        channels = [connection.channel for connection in connections]
+        return {
+            'connections': len(channels),
+            'users': self.connections.users,
+            'bytes_in': sum(connection.bytes_in for connection in connections),
+            'bytes_out': sum(connection.bytes_out for connection in connections),
+            'queued': sum(channel.depth for channel in channels),
+            'max_depth': max((channel.depth for channel in channels), default=0),
+            'high_water': max((channel.high_water for channel in channels), default=0),
+            'dropped': sum(channel.dropped for channel in channels),
+            'coalesced': sum(channel.coalesced for channel in channels),
+        }
+
+    async def deliver_from_peer(self, client_id: str, payload: str, receipt: Optional[Receipt] = None):
+        return any(self.deliver_local(client_id, payload, receipt).values())
+
+    async def notify_client(
+        self,
+        client_id: Union[str, int],
+        message: BaseModel,
+        receipt: Optional[Receipt] = None,
+    ):
+        '''
+        Queue the message for every socket of the client, here and on the other workers.
+        `receipt` is marked by whichever socket actually sends it
+        '''
         client_id = str(client_id)
-        if client_id in self.active_connections:
-            # Loop through all the connections under the id and notify
-            for websocket_connection in self.active_connections[client_id]:
-                await websocket_connection.send_text(json.dumps(message.model_dump()))
-            return True
-        return False
+        payload = dump_model(message)
+        sockets = self.deliver_local(client_id, payload, receipt)
+        # The client may also be connected to other workers, from other devices
+        delivered_elsewhere = await self.broker.publish(client_id, payload, receipt)
+        return DeliveryReport(sockets, remote=delivered_elsewhere)
+
+    def reply(
+        self,
+        websocket: WebSocket,
+        message: BaseModel,
+        on_delivered: Optional[Callable[[], None]] = None,
+        key: Optional[str] = None,
+        droppable: bool = False,
+    ) -> bool:
+        '''
+        Answer a request on the socket it came from only, not every device of the client.
+        `key` and `droppable` are for answers carrying no chat, see OutboundChannel.put
+        '''
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return False
+        return connection.channel.put(dump_model(message), on_delivered, key=key, droppable=droppable)
 
-    async def handle_error(self, client_id: str, error_message: Optional[str] = None):
+    async def handle_error(self, websocket: WebSocket, error_message: Optional[str] = None):
         if error_message is not None:
             notification = WSObject(
                 action='ERROR',
@@ -164,67 +560,249 @@ class ConnectionManager:
                     message=error_message
                 ),
             )
-            await self.notify_client(client_id, notification)
+            self.reply(websocket, notification, droppable=True)
+
+    def parse_message(self, message: str) -> Tuple[Optional[InboundFrame], Optional[str]]:
+        '''
+        Validate a raw frame in a single pass, returns the frame of its action or an error message
+        '''
+        try:
+            return actions.validate_json(message), None
+        except ValidationError as e:
+            # print(traceback.print_exc())
+            if any(error['type'] == 'json_invalid' for error in e.errors()):
+                return None, "Not a valid JSON formatted String"
+            return None, "Request body is not properly formatted"
+
+    async def process_message(
+            self,
+            websocket: WebSocket,
+            token: str,
+            client_id: str,
+            frame: InboundFrame,
+    ):
+        # Handle different actions
+        handler = actions.handler(frame.action)
+        error_message = await handler(self, websocket, token, client_id, frame)
+        await self.handle_error(websocket, error_message)
+
+    @actions.register(ALLOWED_ACTIONS.SEND_MESSAGE, SendMessageFrame)
+    async def handle_send_message(self, websocket: WebSocket, token: str, client_id: str, frame: SendMessageFrame):
+        return await self.send_message(token, client_id, frame.body)
+
+    @actions.register(ALLOWED_ACTIONS.SEND_MESSAGES, SendMessagesFrame)
+    async def handle_send_messages(self, websocket: WebSocket, token: str, client_id: str, frame: SendMessagesFrame):
+        if self.forwarder is not None:
+            return await self.send_messages_locally(token, client_id, frame.body)
+        # One conversation at a time keeps its order, different conversations go concurrently
+        conversations: Dict[str, List[SendMessageRequest]] = {}
+        for chat in frame.body:
+            conversations.setdefault(str(chat.receiver_id), []).append(chat)
+
+        async def send_in_order(chats: List[SendMessageRequest]):
+            return [await self.send_message(token, client_id, chat) for chat in chats]
+
+        results = await asyncio.gather(*[send_in_order(chats) for chats in conversations.values()])
+        errors = {error for result in results for error in result if error is not None}
+        return '; '.join(sorted(errors)) if errors else None
+
+    async def send_message(self, token: str, client_id: str, chat: SendMessageRequest):
+        if str(chat.receiver_id) == client_id:
+            return "Messaging ownself isn't supported yet"
+        if self.forwarder is not None:
+            sent_message = await self.save_chat_locally(token, client_id, chat)
+        else:
+            # Send chat
+            sent_message = await send_chat_message(
+                token=token,
+                msg=chat.model_dump(exclude_none=True)
+            )
+        if sent_message:
+            # Deliver the message, it is marked as delivered once a socket sent it
+            await self.notify_client(
+                client_id=chat.receiver_id,
+                message=WSObject(
+                    action=ALLOWED_ACTIONS.NEW_MESSAGE,
+                    body=sent_message
+                ),
+                receipt=(token, sent_message.get('id')),
+            )
+        return None
+
+    async def save_chat_locally(self, token: str, client_id: str, chat: SendMessageRequest):
+        '''
+        Write-behind: the chat is durable once saved here with its outbox entry,
+        the forwarder replicates it upstream in the background
+        '''
+        try:
+            async with SessionLocal() as db:
+                saved_chat = await save_chat(
+                    ChatCreate(sender_id=client_id, **chat.model_dump(exclude_none=True)),
+                    db,
+                    outbox=True,
+                )
+        except Exception as e:
+            logger.exception(e)
+            return None
+        self.forwarder.queued(client_id, token)
+        return saved_chat.model_dump()
+
+    async def send_messages_locally(self, token: str, client_id: str, chats: List[SendMessageRequest]):
+        '''
+        Write-behind: the whole batch is saved in one transaction with its outbox
+        entries, then every chat is delivered in order
+        '''
+        error_message = None
+        to_save = []
+        for chat in chats:
+            if str(chat.receiver_id) == client_id:
+                error_message = "Messaging ownself isn't supported yet"
+            else:
+                to_save.append(ChatCreate(sender_id=client_id, **chat.model_dump(exclude_none=True)))
+        if not to_save:
+            return error_message
+        try:
+            async with SessionLocal() as db:
+                saved_chats = await save_chats_in_bulk(to_save, db, outbox=True)
+        except Exception as e:
+            logger.exception(e)
+            return error_message
+        self.forwarder.queued(client_id, token, count=len(saved_chats))
+        for saved_chat in saved_chats:
+            await self.notify_client(
+                client_id=saved_chat.receiver_id,
+                message=WSObject(
+                    action=ALLOWED_ACTIONS.NEW_MESSAGE,
+                    body=saved_chat.model_dump(),
+                ),
+                receipt=(token, saved_chat.id),
+            )
+        return error_message
+
+    @actions.register(ALLOWED_ACTIONS.FETCH_CONVERSATION, FetchConversationFrame)
+    async def handle_fetch_conversation(self, websocket: WebSocket, token: str, client_id: str, frame: FetchConversationFrame):
+        req_data: FetchConversationRequest = frame.body
+        partner_id = str(req_data.partner_id)
+        if partner_id == client_id:
+            return "Conversation with ownself isn't supported yet"
+        # Served from the local database, the socket is already authenticated
+        async with SessionLocal() as db:
+            page = await fetch_single_conversation_upto_a_certain_time(
+                user_id1=client_id,
+                user_id2=partner_id,
+                db=db,
+                max_timestamp=req_data.max_timestamp,
+                limit=req_data.limit,
+                before_id=req_data.before_id,
+                after_id=req_data.after_id,
+            )
+        conversation_object = WSObject(
+            action=ALLOWED_ACTIONS.CONVERSATION,
+            body=ConversationObject(
+                partner_id=partner_id,
+                conversation=page['conversation'],
+                next_cursor=page['next_cursor'],
+            )
+        )
+        # Only messages sent to this client become delivered by reading them,
+        # once the page is actually sent
+        undelivered = [
+            chat['id'] for chat in page['conversation']
+            if chat['receiver_id'] == client_id and not chat['delivered']
+        ]
+        self.reply(
+            websocket,
+            conversation_object,
+            on_delivered=(lambda: asyncio.ensure_future(self.mark_page_delivered(undelivered))) if undelivered else None,
+        )
+        return None
+
+    async def mark_page_delivered(self, chat_ids: List[int]):
+        try:
+            async with SessionLocal() as db:
+                await update_as_delivered_in_bulk(chat_ids, db, outbox=self.forwarder is not None)
+        except Exception as e:
+            logger.exception(e)
+
+    @actions.register(ALLOWED_ACTIONS.FETCH_CONVERSATION_LIST, FetchConversationListFrame)
+    async def handle_fetch_conversation_list(self, websocket: WebSocket, token: str, client_id: str, frame: FetchConversationListFrame):
+        async with SessionLocal() as db:
+            summary = await fetch_initial_conversations(
+                client_id,
+                db,
+                limit=frame.body.limit,
+                offset=frame.body.offset,
+            )
+        # A newer snapshot of the same inbox page supersedes a queued one
+        self.reply(
+            websocket,
+            WSObject(
+                action=ALLOWED_ACTIONS.UNREAD_CONVERSATION,
+                body=summary,
+            ),
+            key=f"{ALLOWED_ACTIONS.UNREAD_CONVERSATION}:{frame.body.offset}:{frame.body.limit}",
+        )
+        return None
 
     async def handle_message(
             self,
+            websocket: WebSocket,
             token: str,
             client_id: str,
             message: str,
     ):
-        try:
-            error_message = None
-            # Check if the message is a valid json
-            message_object: dict = json.loads(message)
-            # Convert to Websocket object
-            ws_object: WSObject = TypeAdapter(WSObject).validate_python(message_object)
-            # Handle different actions
-            if ws_object.action == ALLOWED_ACTIONS.SEND_MESSAGE:
-                chat: SendMessageRequest = TypeAdapter(SendMessageRequest).validate_python(ws_object.body)
-                # print(chat)
-                if str(chat.receiver_id) == client_id:
-                    error_message="Messaging ownself isn't supported yet"
-                    # It's done!
-                else:
-                    # Send chat
-                    sent_message = await send_chat_message(
-                        token=token,
-                        msg=chat.model_dump()
-                    )
-                    if sent_message:
-                        # Deliver the message
-                        client_is_notified = await self.notify_client(
-                            client_id=chat.receiver_id,
-                            message=WSObject(
-                                action=ALLOWED_ACTIONS.NEW_MESSAGE,
-                                body=sent_message
-                            )
-                        )
-                        if client_is_notified:
-                            # Mark as delivered in database
-                            await mark_message_as_delivered(token, sent_message.get('id'))
-
-            # elif ws_object.action == ALLOWED_ACTIONS.FETCH_CONVERSATION:
-            #     req_data: FetchConversationRequest = TypeAdapter(FetchConversationRequest).validate_python(ws_object.body)
-            #     conversation = await get_messages_with_a_partner(token, req_data.partner_id)
-            #     # Process database object
-            #     conversation_object = WSObject(
-            #         action = ALLOWED_ACTIONS.CONVERSATION,
-            #         body = ConversationObject(
-            #             partner_id=req_data.partner_id,
-            #             conversation=conversation
-            #         )
-            #     )
-            #     client_notified = await self.notify_client(client_id, conversation_object)
-            #     if client_notified:
-            #         await mark_conversation_as_delivered(token, req_data.partner_id)
-        except JSONDecodeError:
-            error_message = "Not a valid JSON formatted String"
-        except ValidationError:
-            # print(traceback.print_exc())
-            error_message = "Request body is not properly formatted"
+        frame, error_message = self.parse_message(message)
+        if frame is None:
+            await self.handle_error(websocket, error_message)
+        else:
+            await self.process_message(websocket, token, client_id, frame)
+
+    async def submit_message(
+            self,
+            pipeline: InboundPipeline,
+            websocket: WebSocket,
+            token: str,
+            client_id: str,
+            message: str,
+    ):
+        '''
+        Like handle_message, but only waits for a free slot in the connection's pipeline
+        '''
+        frame, error_message = self.parse_message(message)
+        if frame is None:
+            await self.handle_error(websocket, error_message)
+        else:
+            await pipeline.submit(
+                frame.ordering_keys(client_id),
+                lambda: self.process_message(websocket, token, client_id, frame),
+            )
+
+
+# Every handler is registered by now, compile the frame validator once
+actions.build()
+
 
-        await self.handle_error(client_id, error_message)
+WRITE_BEHIND = settings.CHAT_WRITE_MODE == 'write_behind'
 
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    broker=create_broker(settings.WS_BROKER, settings.WS_BROKER_SOCKET_DIR),
+    send_timeout=settings.WS_SEND_TIMEOUT,
+    queue_size=settings.WS_QUEUE_SIZE,
+    overflow_policy=settings.WS_OVERFLOW_POLICY,
+    receipts=DeliveryReceiptBatcher(
+        mark_messages_as_delivered_locally if WRITE_BEHIND else mark_messages_as_delivered,
+        interval=settings.RECEIPT_FLUSH_INTERVAL,
+        max_batch=settings.RECEIPT_BATCH_SIZE,
+        max_attempts=settings.RECEIPT_MAX_ATTEMPTS,
+    ),
+    replay_batch_size=settings.WS_REPLAY_BATCH_SIZE,
+    forwarder=OutboxForwarder(
+        forward_chat_messages,
+        forward_delivered_marks,
+        interval=settings.OUTBOX_FLUSH_INTERVAL,
+        max_batch=settings.OUTBOX_BATCH_SIZE,
+        max_backoff=settings.OUTBOX_MAX_BACKOFF,
+        max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+    ) if WRITE_BEHIND else None,
+)
@@ -0,0 +1,272 @@
+import asyncio
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from api.database import SessionLocal
+from api.public.chat.crud import fetch_outbox, fetch_outbox_senders, set_upstream_ids, settle_outbox
+from api.utils.logger import logger_config
+
+
+logger = logger_config(__name__)
+
+
+# Kinds of outbox entries
+CHAT = 'chat'
+DELIVERED = 'delivered'
+
+# Outcomes of one upstream request
+FORWARDED = 'forwarded'
+REJECTED = 'rejected'
+UNAUTHORIZED = 'unauthorized'
+
+# Outcomes of forwarding one batch of a sender
+DONE = 'done'
+MORE = 'more'
+RETRY = 'retry'
+WAITING = 'waiting'
+
+
+def upstream_outcome(status_code: int) -> str:
+    '''
+    Whether an upstream answer forwarded the entry, refused it for good, refused the
+    token or may succeed when retried
+    '''
+    if status_code < 300:
+        return FORWARDED
+    if status_code in (401, 403):
+        return UNAUTHORIZED
+    if status_code in (408, 429) or status_code >= 500:
+        return RETRY
+    return REJECTED
+
+
+class ForwardResult:
+    '''
+    What became of a batch of chats sent upstream, by local chat id.
+    Chats in none of the sets were not tried
+    '''
+    __slots__ = ('forwarded', 'retry', 'rejected', 'unauthorized')
+
+    def __init__(self):
+        # chat id -> upstream id, None when the backend did not tell
+        self.forwarded: Dict[int, Optional[int]] = {}
+        self.retry: Set[int] = set()
+        self.rejected: Set[int] = set()
+        # The token was refused, nothing more can be forwarded with it
+        self.unauthorized = False
+
+
+# (token, chats) -> what became of them
+ForwardCallback = Callable[[str, List[dict]], Awaitable[ForwardResult]]
+
+
+class OutboxForwarder:
+    """
+    Replicates chats saved locally in write-behind mode, and then their
+    delivered-marks, to the upstream backend.
+    Senders with entries in the outbox are forwarded every `interval` seconds, or as
+    soon as `max_batch` chats are queued, at most `max_batch` entries per sender at a
+    time and with the sender's latest token. Forwarded entries leave the outbox;
+    after a failure the sender backs off exponentially, up to `max_backoff` seconds.
+    Entries rejected with a 4xx, or failing `max_attempts` times, are dead-lettered
+    so they no longer hold back the rest of the outbox. A refused token is dropped
+    until the sender is seen again, as are tokens after a restart. Delivered-marks
+    are queued by other workers too, so the outbox is also swept for senders every
+    `sweep_interval` seconds.
+    """
+    def __init__(
+        self,
+        forward: ForwardCallback,
+        forward_delivered: ForwardCallback,
+        interval: float = 0.05,
+        max_batch: int = 100,
+        backoff: float = 0.5,
+        max_backoff: float = 60.0,
+        max_attempts: int = 10,
+        sweep_interval: float = 5.0,
+    ):
+        self.forward = forward
+        self.forward_delivered = forward_delivered
+        self.interval = interval
+        self.max_batch = max_batch
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.sweep_interval = sweep_interval
+        self.tokens: Dict[str, str] = {}
+        # sender -> when it may be forwarded next (monotonic)
+        self._due: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        # Queued again while being forwarded, the sender stays due
+        self._fresh: Set[str] = set()
+        # Queued chats but no token to forward them with
+        self._waiting: Set[str] = set()
+        self._queued = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._swept_at = 0.0
+        self.forwarded = 0
+        self.failed = 0
+        self.dead_lettered = 0
+
+    def remember(self, sender_id: str, token: str):
+        self.tokens[sender_id] = token
+        if sender_id in self._waiting:
+            self._waiting.discard(sender_id)
+            self._due.setdefault(sender_id, 0.0)
+            self._wakeup.set()
+
+    def queued(self, sender_id: str, token: str, count: int = 1):
+        '''
+        `count` chats of the sender were just saved to the outbox
+        '''
+        self.tokens[sender_id] = token
+        self._waiting.discard(sender_id)
+        self._due.setdefault(sender_id, 0.0)
+        self._fresh.add(sender_id)
+        self._queued += count
+        if self._queued >= self.max_batch:
+            self._wakeup.set()
+
+    async def start(self):
+        # Whatever a previous run left behind
+        await self.sweep()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def sweep(self):
+        '''
+        Pick up senders with entries queued by another worker, or before a restart
+        '''
+        self._swept_at = monotonic()
+        async with SessionLocal() as db:
+            senders = await fetch_outbox_senders(db)
+        for sender_id in senders:
+            if sender_id in self.tokens:
+                self._due.setdefault(sender_id, 0.0)
+            else:
+                self._waiting.add(sender_id)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Last chance for everything still queued, backoff or not
+        await self.forward_pending(force=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if monotonic() - self._swept_at >= self.sweep_interval:
+                    await self.sweep()
+                await self.forward_pending()
+            except Exception as e:
+                logger.exception(e)
+
+    async def forward_pending(self, force: bool = False):
+        now = monotonic()
+        senders = [sender_id for sender_id, due in self._due.items() if force or due <= now]
+        if not senders:
+            return
+        self._queued = 0
+        self._fresh.difference_update(senders)
+        results = await asyncio.gather(
+            *[self._forward_sender(sender_id) for sender_id in senders],
+            return_exceptions=True,
+        )
+        for sender_id, outcome in zip(senders, results):
+            if isinstance(outcome, BaseException):
+                logger.info(f"Forwarding the outbox of {sender_id} failed: {outcome!r}")
+                outcome = RETRY
+            if outcome == RETRY:
+                failures = self._failures[sender_id] = self._failures.get(sender_id, 0) + 1
+                self._due[sender_id] = monotonic() + min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+                continue
+            self._failures.pop(sender_id, None)
+            if outcome == MORE or sender_id in self._fresh:
+                self._due[sender_id] = 0.0
+                self._wakeup.set()
+            else:
+                self._due.pop(sender_id, None)
+                if outcome == WAITING:
+                    self._waiting.add(sender_id)
+
+    async def _forward_sender(self, sender_id: str) -> str:
+        token = self.tokens.get(sender_id)
+        if token is None:
+            return WAITING
+        async with SessionLocal() as db:
+            rows = await fetch_outbox(sender_id, db, limit=self.max_batch)
+            if not rows:
+                return DONE
+            chats = [chat for entry, chat in rows if entry['kind'] == CHAT]
+            sent = await self.forward(token, chats) if chats else ForwardResult()
+            await set_upstream_ids(
+                {chat_id: upstream_id for chat_id, upstream_id in sent.forwarded.items() if upstream_id is not None},
+                db,
+            )
+            upstream_ids = {chat['id']: chat['upstream_id'] for _, chat in rows}
+            upstream_ids.update(sent.forwarded)
+            # A chat always enters the outbox before its delivered-mark, so a chat
+            # still to be forwarded is in this batch, behind it the mark waits
+            pending = {chat['id'] for chat in chats} - set(sent.forwarded)
+            marks = []
+            # Chats never forwarded, forwarded without an upstream id or forwarded
+            # just now as delivered already, have no mark to forward
+            dropped = []
+            for entry, chat in rows:
+                if entry['kind'] != DELIVERED:
+                    continue
+                if chat['id'] in sent.forwarded and chat['delivered']:
+                    dropped.append(entry['id'])
+                elif upstream_ids.get(chat['id']) is not None:
+                    marks.append({**chat, 'upstream_id': upstream_ids[chat['id']]})
+                elif chat['id'] not in pending or chat['id'] in sent.rejected:
+                    dropped.append(entry['id'])
+            marked = ForwardResult()
+            if marks and not sent.unauthorized:
+                marked = await self.forward_delivered(token, marks)
+
+            done, retried, dead = list(dropped), [], []
+            for entry, chat in rows:
+                result = sent if entry['kind'] == CHAT else marked
+                if chat['id'] in result.forwarded:
+                    done.append(entry['id'])
+                elif chat['id'] in result.rejected:
+                    dead.append(entry['id'])
+                    logger.warning(f"Outbox entry {entry['id']} ({entry['kind']} of chat {chat['id']}) rejected upstream")
+                elif chat['id'] in result.retry:
+                    if entry['attempts'] + 1 >= self.max_attempts:
+                        dead.append(entry['id'])
+                        logger.warning(f"Outbox entry {entry['id']} ({entry['kind']} of chat {chat['id']}) failed {self.max_attempts} times")
+                    else:
+                        retried.append(entry['id'])
+            await settle_outbox(done, retried, dead, db)
+        self.forwarded += len(done) - len(dropped)
+        self.failed += len(retried)
+        self.dead_lettered += len(dead)
+        if sent.unauthorized or marked.unauthorized:
+            logger.info(f"Upstream refused the token of {sender_id}, waiting for a new one")
+            if self.tokens.get(sender_id) == token:
+                del self.tokens[sender_id]
+            return WAITING
+        if sent.retry or marked.retry:
+            return RETRY
+        return MORE if len(rows) == self.max_batch else DONE
+
+    def stats(self):
+        return {
+            'senders': len(self._due),
+            'waiting_for_token': len(self._waiting),
+            'forwarded': self.forwarded,
+            'failed': self.failed,
+            'dead_lettered': self.dead_lettered,
+        }
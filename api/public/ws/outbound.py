@@ -0,0 +1,148 @@
+import asyncio
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple
+
+from fastapi import WebSocket
+
+from api.utils.serialization import text_size
+
+
+class OverflowPolicy:
+    DISCONNECT = 'disconnect' # the consumer is too slow, close it
+    DROP_OLDEST = 'drop_oldest' # discard the oldest droppable frame to make room, else disconnect
+    COALESCE = 'coalesce' # a frame replaces a queued one with the same key, else drop oldest
+
+    all_policies = (DISCONNECT, DROP_OLDEST, COALESCE)
+
+
+class OutboundChannel:
+    """
+    Bounded outbound queue of a single WebSocket, drained by its own writer task.
+    Producers only enqueue, so a slow receiver never holds up the sender.
+    Frames carrying chats are never dropped: when `max_size` frames pile up and
+    `policy` finds no droppable frame to make room, the receiver is too slow and
+    gets disconnected, like one whose socket fails or times out. `on_failure` is
+    called once then, the channel accepts nothing afterwards and whatever was
+    still queued is never sent.
+    `on_sent`, if given, is called with the size in bytes of every frame sent.
+    """
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_failure: Callable[[], None],
+        max_size: int = 256,
+        policy: str = OverflowPolicy.DISCONNECT,
+        send_timeout: float = 5.0,
+        on_sent: Optional[Callable[[int], None]] = None,
+    ):
+        self.websocket = websocket
+        self.on_failure = on_failure
+        self.max_size = max_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_sent = on_sent
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water = 0
+        # (payload, called once the payload is sent, key, droppable)
+        self._queue: Deque[Tuple[str, Optional[Callable[[], None]], Optional[str], bool]] = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def put(
+        self,
+        payload: str,
+        on_delivered: Optional[Callable[[], None]] = None,
+        key: Optional[str] = None,
+        droppable: bool = False,
+    ) -> bool:
+        '''
+        Queue a frame for sending, False if it was not queued: the channel is closed,
+        just overflowed into a disconnect, or the frame itself was dropped.
+        `on_delivered` is called by the writer once the frame is actually sent,
+        never for frames lost with the socket.
+        Only frames that carry no chat may be `droppable`; a `key` makes a frame
+        droppable and lets COALESCE replace it with a newer one, e.g. a snapshot.
+        '''
+        if self.closed:
+            return False
+        droppable = droppable or key is not None
+        if self.policy == OverflowPolicy.COALESCE and key is not None:
+            for index, (_, _, queued_key, _) in enumerate(self._queue):
+                if queued_key == key:
+                    self._queue[index] = (payload, on_delivered, key, True)
+                    self.coalesced += 1
+                    return True
+        if len(self._queue) >= self.max_size:
+            if self.policy == OverflowPolicy.DISCONNECT:
+                self._fail()
+                return False
+            if not self._drop_oldest():
+                if droppable:
+                    self.dropped += 1
+                else:
+                    self._fail()
+                return False
+        self._queue.append((payload, on_delivered, key, droppable))
+        self.high_water = max(self.high_water, len(self._queue))
+        self._ready.set()
+        return True
+
+    def _drop_oldest(self) -> bool:
+        for index, (_, _, _, droppable) in enumerate(self._queue):
+            if droppable:
+                del self._queue[index]
+                self.dropped += 1
+                return True
+        return False
+
+    async def _run(self):
+        while not self.closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            payload, on_delivered, _, _ = self._queue.popleft()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(payload), self.send_timeout)
+                self.sent += 1
+                if self.on_sent is not None:
+                    self.on_sent(text_size(payload))
+                if on_delivered is not None:
+                    on_delivered()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._fail()
+
+    def _fail(self):
+        if not self.closed:
+            self.closed = True
+            self.dropped += len(self._queue)
+            self._queue.clear()
+            self.on_failure()
+
+    def close(self):
+        self.closed = True
+        self._queue.clear()
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'high_water': self.high_water,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
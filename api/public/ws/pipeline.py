@@ -0,0 +1,53 @@
+import asyncio
+from typing import AbstractSet, Awaitable, Callable, Dict, Set
+
+from api.utils.logger import logger_config
+
+
+logger = logger_config(__name__)
+
+
+class InboundPipeline:
+    """
+    Runs the frames of a single connection concurrently so reading never waits
+    on processing. At most `window` frames are in flight (submit blocks beyond
+    that, pushing back on the reader), and frames sharing a key, e.g. the same
+    conversation, run strictly in arrival order. A frame with several keys waits
+    for the frames before it on every one of them.
+    """
+    def __init__(self, window: int = 8):
+        self._slots = asyncio.Semaphore(window)
+        self._tails: Dict[str, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    async def submit(self, keys: AbstractSet[str], process: Callable[[], Awaitable[None]]):
+        await self._slots.acquire()
+        previous = {self._tails[key] for key in keys if key in self._tails}
+        task = asyncio.ensure_future(self._run(previous, process))
+        self._tasks.add(task)
+        for key in keys:
+            self._tails[key] = task
+        task.add_done_callback(lambda done: self._finish(keys, done))
+
+    async def _run(self, previous: Set[asyncio.Task], process: Callable[[], Awaitable[None]]):
+        if previous:
+            # Whatever their outcome, only the order matters here
+            await asyncio.wait(previous)
+        await process()
+
+    def _finish(self, keys: AbstractSet[str], task: asyncio.Task):
+        self._slots.release()
+        self._tasks.discard(task)
+        for key in keys:
+            if self._tails.get(key) is task:
+                del self._tails[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.exception(task.exception())
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
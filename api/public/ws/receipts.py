@@ -0,0 +1,139 @@
+import asyncio
+from time import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from api.utils.logger import logger_config
+
+
+logger = logger_config(__name__)
+
+
+# (token, chat_ids) -> the chat ids that could not be marked
+FlushCallback = Callable[[str, List[int]], Awaitable[List[int]]]
+
+
+class DeliveryReceiptBatcher:
+    """
+    Collects delivered-marks off the message hot path and flushes them in bulk,
+    every `interval` seconds or as soon as `max_batch` ids are pending.
+    Ids are grouped by the token they must be marked with. Failed ids are retried
+    with exponential backoff up to `max_attempts` (at-least-once), and whatever is
+    pending is flushed once more on stop.
+    """
+    def __init__(
+        self,
+        flush: FlushCallback,
+        interval: float = 0.05,
+        max_batch: int = 100,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+    ):
+        self.flush = flush
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        # token -> {chat_id: attempts so far}
+        self._pending: Dict[str, Dict[int, int]] = {}
+        # (ready at, token, chat_id, attempts so far)
+        self._retries: List[Tuple[float, str, int, int]] = []
+        self._size = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # The flush in progress, it owns the ids it swapped out of _pending
+        self._flushing: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.failed = 0
+        self.given_up = 0
+
+    def add(self, token: str, chat_id: int, attempts: int = 0):
+        ids = self._pending.setdefault(token, {})
+        if chat_id not in ids:
+            self._size += 1
+        ids[chat_id] = attempts
+        if self._size >= self.max_batch:
+            self._wakeup.set()
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._flushing is not None and not self._flushing.done():
+            # Its failed ids come back as retries
+            try:
+                await self._flushing
+            except Exception as e:
+                logger.exception(e)
+        # Last chance for everything still waiting, retries included
+        for _, token, chat_id, attempts in self._retries:
+            self.add(token, chat_id, attempts)
+        self._retries.clear()
+        await self.flush_pending()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._requeue_due_retries()
+            self._flushing = asyncio.ensure_future(self.flush_pending())
+            try:
+                # Cancelling the loop must not cancel a flush half way
+                await asyncio.shield(self._flushing)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+
+    def _requeue_due_retries(self):
+        now = monotonic()
+        due = [retry for retry in self._retries if retry[0] <= now]
+        if due:
+            self._retries = [retry for retry in self._retries if retry[0] > now]
+            for _, token, chat_id, attempts in due:
+                self.add(token, chat_id, attempts)
+
+    async def flush_pending(self):
+        if not self._pending:
+            return
+        pending, self._pending, self._size = self._pending, {}, 0
+        tokens = list(pending.keys())
+        results = await asyncio.gather(
+            *[self.flush(token, list(pending[token].keys())) for token in tokens],
+            return_exceptions=True,
+        )
+        for token, failed_ids in zip(tokens, results):
+            ids = pending[token]
+            if isinstance(failed_ids, BaseException):
+                logger.info(f"Delivery receipts flush failed: {failed_ids!r}")
+                failed_ids = list(ids.keys())
+            self.flushed += len(ids) - len(failed_ids)
+            for chat_id in failed_ids:
+                self._retry(token, chat_id, ids.get(chat_id, 0) + 1)
+
+    def _retry(self, token: str, chat_id: int, attempts: int):
+        self.failed += 1
+        if attempts >= self.max_attempts:
+            self.given_up += 1
+            logger.info(f"Giving up marking chat {chat_id} as delivered after {attempts} attempts")
+            return
+        ready_at = monotonic() + self.backoff * 2 ** (attempts - 1)
+        self._retries.append((ready_at, token, chat_id, attempts))
+
+    def stats(self):
+        return {
+            'pending': self._size,
+            'retrying': len(self._retries),
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'given_up': self.given_up,
+        }
@@ -0,0 +1,95 @@
+from time import monotonic
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from api.public.ws.outbound import OutboundChannel
+
+
+class Connection:
+    '''
+    A single open socket of a user and its traffic counters
+    '''
+    __slots__ = (
+        'websocket',
+        'user_id',
+        'channel',
+        'connected_at',
+        'last_activity',
+        'bytes_in',
+        'bytes_out',
+        'held',
+    )
+
+    def __init__(self, websocket: WebSocket, user_id: str, channel: Optional[OutboundChannel] = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.channel = channel
+        self.connected_at = self.last_activity = monotonic()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Deliveries arriving while missed messages are replayed, as
+        # (payload, on_delivered, chat id), None once the connection is live
+        self.held: Optional[List[Tuple[str, Optional[Callable[[], None]], Optional[int]]]] = None
+
+    def received(self, size: int):
+        self.bytes_in += size
+        self.last_activity = monotonic()
+
+    def sent(self, size: int):
+        self.bytes_out += size
+
+
+class ConnectionRegistry:
+    """
+    Open connections by user and by socket, a single user can be connected from
+    several devices. Adding, removing and looking up are O(1), removing is
+    idempotent. None of the methods await, so they never interleave on the event
+    loop, and `of_user` returns a snapshot that stays valid while the registry changes.
+    """
+    def __init__(self):
+        self._by_user: Dict[str, Set[Connection]] = {}
+        self._by_socket: Dict[WebSocket, Connection] = {}
+
+    def __len__(self):
+        return len(self._by_socket)
+
+    def __contains__(self, websocket: WebSocket):
+        return websocket in self._by_socket
+
+    def __iter__(self) -> Iterator[Connection]:
+        return iter(list(self._by_socket.values()))
+
+    @property
+    def users(self):
+        return len(self._by_user)
+
+    def add(self, connection: Connection) -> Connection:
+        self.remove(connection.websocket)
+        self._by_socket[connection.websocket] = connection
+        self._by_user.setdefault(connection.user_id, set()).add(connection)
+        return connection
+
+    def remove(self, websocket: WebSocket) -> Optional[Connection]:
+        connection = self._by_socket.pop(websocket, None)
+        if connection is not None:
+            connections = self._by_user.get(connection.user_id)
+            if connections is not None:
+                connections.discard(connection)
+                # No device of the user left
+                if not connections:
+                    del self._by_user[connection.user_id]
+        return connection
+
+    def get(self, websocket: WebSocket) -> Optional[Connection]:
+        return self._by_socket.get(websocket)
+
+    def of_user(self, user_id: str) -> Tuple[Connection, ...]:
+        return tuple(self._by_user.get(user_id, ()))
+
+    def is_connected(self, user_id: str) -> bool:
+        return user_id in self._by_user
+
+    def clear(self):
+        self._by_user.clear()
+        self._by_socket.clear()
@@ -1,8 +1,10 @@
-from typing import Any, List, Optional, Union
-from pydantic import BaseModel, ValidationError, field_validator
+from typing import Annotated, Any, FrozenSet, List, Literal, Optional, Union
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
 
-from api.public.chat.schemas import ChatInput
+from api.config import settings
+from api.public.chat.schemas import ChatBulkInput, ChatInput
 from api.public.ws import ALLOWED_ACTIONS
+from api.utils import generate_conversation_id
 
 
 # 'SEND-MESSAGE'
@@ -10,6 +12,11 @@ class SendMessageRequest(ChatInput):
     pass
 
 
+# an item of 'SEND-MESSAGES', e.g. from an offline outbox, may keep its created_at
+class SendMessagesItem(SendMessageRequest, ChatBulkInput):
+    pass
+
+
 # General chat object
 class SingleMessageDistribution(SendMessageRequest):
     sender_id: str
@@ -26,6 +33,7 @@ class NewMessageDistribution(SingleMessageDistribution):
 class ConversationObject(BaseModel):
     partner_id: Union[str, int]
     conversation: List[dict]
+    next_cursor: Optional[int] = None
 
     @field_validator('partner_id')
     def convert_to_string(cls, value):
@@ -37,16 +45,35 @@ class UnreadConversationDistribution(ConversationObject):
     pass
 
 
+# 'UNREAD-MESSAGES'
+class UnreadMessagesDistribution(BaseModel):
+    messages: List[dict]
+
+
 # 'FETCH-CONVERSATION'
 class FetchConversationRequest(BaseModel):
     partner_id: Union[str, int]
     max_timestamp: Optional[Union[int, None]] = None
-    limit: Optional[Union[int, None]] = 100
+    before_id: Optional[int] = None
+    after_id: Optional[int] = None
+    limit: Optional[int] = Field(None, ge=1, le=settings.CHAT_PAGE_MAX_SIZE)
 
     @field_validator('partner_id')
     def convert_to_string(cls, value):
         return int(value)
 
+    @model_validator(mode='after')
+    def one_cursor(self):
+        if self.before_id is not None and self.after_id is not None:
+            raise ValueError('Use either before_id or after_id, not both')
+        return self
+
+
+# 'FETCH-CONVERSATION-LIST'
+class FetchConversationListRequest(BaseModel):
+    limit: Optional[int] = Field(None, ge=1, le=settings.INBOX_PAGE_MAX_SIZE)
+    offset: int = Field(0, ge=0)
+
 
 # Any incoming or outgoing message object
 class WSObject(BaseModel):
@@ -62,6 +89,54 @@ class WSObject(BaseModel):
             raise ValidationError
 
 
+# Incoming frames, one model per client action, the action being the discriminator
+class InboundFrame(BaseModel):
+    action: str
+    body: Any
+
+    @field_validator('action', mode='before')
+    def upper_case_action(cls, value):
+        return value.upper() if isinstance(value, str) else value
+
+    def ordering_keys(self, client_id: str) -> FrozenSet[str]:
+        '''
+        Frames sharing a key are processed in arrival order, no keys means no ordering
+        '''
+        return frozenset()
+
+
+class SendMessageFrame(InboundFrame):
+    action: Literal['SEND-MESSAGE']
+    body: SendMessageRequest
+
+    def ordering_keys(self, client_id: str) -> FrozenSet[str]:
+        # Messages of a conversation must reach the receiver in the order they were sent
+        return frozenset((generate_conversation_id(client_id, str(self.body.receiver_id)),))
+
+
+class SendMessagesFrame(InboundFrame):
+    action: Literal['SEND-MESSAGES']
+    body: Annotated[List[SendMessagesItem], Field(min_length=1, max_length=settings.CHAT_BULK_MAX_SIZE)]
+
+    def ordering_keys(self, client_id: str) -> FrozenSet[str]:
+        # Ordered against the frames of every conversation in the batch
+        return frozenset(generate_conversation_id(client_id, str(chat.receiver_id)) for chat in self.body)
+
+
+class FetchConversationFrame(InboundFrame):
+    action: Literal['FETCH-CONVERSATION']
+    body: FetchConversationRequest
+
+    def ordering_keys(self, client_id: str) -> FrozenSet[str]:
+        # A page fetched after sending a message must contain it
+        return frozenset((generate_conversation_id(client_id, str(self.body.partner_id)),))
+
+
+class FetchConversationListFrame(InboundFrame):
+    action: Literal['FETCH-CONVERSATION-LIST']
+    body: FetchConversationListRequest = FetchConversationListRequest()
+
+
 #### CHAT SCHEMAS ENDS
 
 
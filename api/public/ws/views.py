@@ -1,7 +1,10 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from websockets import ConnectionClosedError
 
+from api.config import settings
 from api.public.ws.connection_manager import manager as connection_manager
+from api.public.ws.pipeline import InboundPipeline
+from api.utils.serialization import text_size
 
 
 router = APIRouter()
@@ -14,11 +17,17 @@ async def websocket_endpoint_for_chat(
     token: str,
 ):
     client_id = await connection_manager.connect(websocket, token)
+    # Keep reading while earlier frames are still being processed
+    pipeline = InboundPipeline(window=settings.WS_INFLIGHT_WINDOW)
     try:
         while client_id is not None:
             message = await websocket.receive_text()
-            await connection_manager.handle_message(token, client_id, message)
-    except WebSocketDisconnect:
-        connection_manager.disconnect(client_id, websocket)
-    except ConnectionClosedError:
+            connection_manager.received(websocket, text_size(message))
+            await connection_manager.submit_message(pipeline, websocket, token, client_id, message)
+    except (WebSocketDisconnect, ConnectionClosedError):
         pass
+    finally:
+        if client_id is not None:
+            connection_manager.disconnect(client_id, websocket)
+        # Messages already received still get sent
+        await pipeline.drain()
@@ -0,0 +1,106 @@
+import importlib.util
+from typing import Optional
+
+import httpx
+
+from api.config import settings
+from api.utils.logger import logger_config
+from api.utils.metrics import LatencyRegistry
+from api.utils.serialization import dumps_bytes
+
+
+logger = logger_config(__name__)
+
+
+HEADER_KEY = 'Authorization'
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+def auth_headers(token: str):
+    return {HEADER_KEY: 'JWT ' + token}
+
+
+class UpstreamClient:
+    """
+    Application-wide pooled HTTP client for calls to the Django backend (AUTH_URI).
+    Opened and closed by the app lifespan; lazily opened on first use otherwise,
+    so keep-alive connections are reused across requests and WebSocket frames.
+    """
+    def __init__(
+        self,
+        base_url: str,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        pool_timeout: float = 5.0,
+        http2: bool = True,
+    ):
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout, pool=pool_timeout)
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.metrics = LatencyRegistry()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self.limits,
+                timeout=self.timeout,
+                http2=self.http2,
+            )
+        return self._client
+
+    async def start(self):
+        client = self.client
+        logger.info(f"upstream client: pool opened for {self.base_url} (http2={self.http2})")
+        return client
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info(f"upstream client: pool closed, metrics {self.metrics.snapshot()}")
+        self._client = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        token: Optional[str] = None,
+        metric: Optional[str] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        '''
+        Send a request over the shared pool and record its latency.
+        `metric` names the endpoint for the latency stats, e.g. '/chat/{id}/',
+        so ids in the path don't create one entry per call.
+        '''
+        headers = kwargs.pop('headers', {})
+        if token is not None:
+            headers = {**headers, **auth_headers(token)}
+        if 'json' in kwargs:
+            kwargs['content'] = dumps_bytes(kwargs.pop('json'))
+            headers = {**headers, 'Content-Type': 'application/json'}
+        kwargs['headers'] = headers
+        with self.metrics.timer(f"{method.upper()} {metric or path}"):
+            return await self.client.request(method, path, **kwargs)
+
+
+upstream = UpstreamClient(
+    base_url=settings.AUTH_URI,
+    max_connections=settings.HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    timeout=settings.HTTP_TIMEOUT,
+    connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+    pool_timeout=settings.HTTP_POOL_TIMEOUT,
+    http2=settings.HTTP2,
+)
@@ -0,0 +1,76 @@
+from time import perf_counter
+from typing import Dict
+
+
+class LatencyStats:
+    """
+    Running latency aggregate for a single operation.
+    Keeps count, total, min and max in milliseconds without storing samples.
+    """
+    __slots__ = ('count', 'errors', 'total_ms', 'min_ms', 'max_ms')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.min_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms: float, error: bool = False):
+        if self.count == 0 or elapsed_ms < self.min_ms:
+            self.min_ms = elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if error:
+            self.errors += 1
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'min_ms': round(self.min_ms, 3),
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+class LatencyRegistry:
+    """
+    Named collection of LatencyStats, e.g. one per upstream endpoint.
+    """
+    def __init__(self):
+        self._stats: Dict[str, LatencyStats] = {}
+
+    def observe(self, name: str, elapsed_ms: float, error: bool = False):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = LatencyStats()
+        stats.observe(elapsed_ms, error)
+
+    def timer(self, name: str):
+        return _Timer(self, name)
+
+    def snapshot(self):
+        return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+    def reset(self):
+        self._stats.clear()
+
+
+class _Timer:
+    __slots__ = ('_registry', '_name', '_started')
+
+    def __init__(self, registry: LatencyRegistry, name: str):
+        self._registry = registry
+        self._name = name
+
+    def __enter__(self):
+        self._started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ms = (perf_counter() - self._started) * 1000
+        self._registry.observe(self._name, elapsed_ms, error=exc_type is not None)
+        return False
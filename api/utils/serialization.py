@@ -0,0 +1,25 @@
+from typing import Any
+
+import orjson
+from pydantic import BaseModel
+
+
+def dump_model(model: BaseModel) -> str:
+    '''
+    Serialize a pydantic model straight to JSON text (pydantic-core, no dict round trip)
+    '''
+    return model.model_dump_json()
+
+
+def dumps_bytes(value: Any) -> bytes:
+    return orjson.dumps(value)
+
+
+def text_size(text: str) -> int:
+    '''
+    Size of text in UTF-8 bytes, as sent on the wire; only non-ASCII text is encoded
+    '''
+    return len(text) if text.isascii() else len(text.encode())
+
+
+loads = orjson.loads
@@ -0,0 +1,72 @@
+"""
+Rows/sec of the single-message save path against the bulk insert path.
+
+    python -m benchmarks.bench_bulk_insert [messages] [batch size]
+
+Runs against a throwaway SQLite database unless DATABASE_URI is set.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+if 'DATABASE_URI' not in os.environ:
+    os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+from api.database import Base, SessionLocal, engine  # noqa: E402
+from api.database import models  # noqa: E402,F401
+from api.public.chat.crud import save_chat, save_chats_in_bulk  # noqa: E402
+from api.public.chat.schemas import ChatCreate  # noqa: E402
+
+
+def make_chats(count: int, users: int = 50):
+    return [
+        ChatCreate(
+            sender_id=str(i % users),
+            receiver_id=(i * 7 + 1) % users or users,
+            text=f"Benchmark message {i} about an ad slot",
+        )
+        for i in range(count)
+    ]
+
+
+async def reset_schema():
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+
+async def bench_single(chats):
+    await reset_schema()
+    async with SessionLocal() as db:
+        started = perf_counter()
+        for chat in chats:
+            await save_chat(chat, db)
+        return len(chats) / (perf_counter() - started)
+
+
+async def bench_bulk(chats, batch_size: int):
+    await reset_schema()
+    async with SessionLocal() as db:
+        started = perf_counter()
+        for offset in range(0, len(chats), batch_size):
+            await save_chats_in_bulk(chats[offset:offset + batch_size], db)
+        return len(chats) / (perf_counter() - started)
+
+
+async def main(count: int = 2000, batch_size: int = 200):
+    chats = make_chats(count)
+    try:
+        single = await bench_single(chats)
+        bulk = await bench_bulk(chats, batch_size)
+    finally:
+        await engine.dispose()
+    print(f"{count} messages on {engine.dialect.name}")
+    print(f"  save_chat            {single:>12,.0f} rows/s")
+    print(f"  save_chats_in_bulk   {bulk:>12,.0f} rows/s  (batches of {batch_size}, {bulk / single:.1f}x)")
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:3]]
+    asyncio.run(main(*args))
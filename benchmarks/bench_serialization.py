@@ -0,0 +1,81 @@
+"""
+Serialization throughput of typical WebSocket frames.
+
+    python -m benchmarks.bench_serialization [iterations]
+
+Compares the old stdlib path (json.dumps(model.model_dump())) with
+pydantic's model_dump_json and orjson, in frames/sec and MB/sec.
+"""
+import json
+import sys
+from time import perf_counter, time_ns
+
+import orjson
+
+from api.public.ws import ALLOWED_ACTIONS
+from api.public.ws.schemas import ConversationObject, WSObject
+
+
+def new_message_frame():
+    return WSObject(
+        action=ALLOWED_ACTIONS.NEW_MESSAGE,
+        body={
+            "id": 48213,
+            "sender_id": "5",
+            "receiver_id": "7",
+            "text": "Hey, is the billboard on 5th avenue still available next month?",
+            "created_at": time_ns() // 1000,
+            "delivered": False,
+            "full_name": "Jane Doe",
+            "profile_image": "https://cdn.admrt.com/profile/5.jpg",
+        },
+    )
+
+
+def conversation_frame(size: int = 50):
+    return WSObject(
+        action=ALLOWED_ACTIONS.CONVERSATION,
+        body=ConversationObject(
+            partner_id=7,
+            conversation=[
+                {
+                    "id": 48213 + i,
+                    "sender_id": "5" if i % 2 else "7",
+                    "receiver_id": "7" if i % 2 else "5",
+                    "conversation_id": "5-7",
+                    "text": f"Message number {i} about the campaign schedule and pricing",
+                    "created_at": time_ns() // 1000 + i,
+                    "delivered": True,
+                }
+                for i in range(size)
+            ],
+        ),
+    )
+
+
+SERIALIZERS = {
+    'json.dumps(model_dump())': lambda frame: json.dumps(frame.model_dump()),
+    'orjson.dumps(model_dump())': lambda frame: orjson.dumps(frame.model_dump()).decode(),
+    'model_dump_json()': lambda frame: frame.model_dump_json(),
+}
+
+
+def bench(frame, serializer, iterations: int):
+    size = len(serializer(frame).encode())
+    started = perf_counter()
+    for _ in range(iterations):
+        serializer(frame)
+    elapsed = perf_counter() - started
+    return size, iterations / elapsed, size * iterations / elapsed / 1e6
+
+
+def main(iterations: int = 20000):
+    for name, frame in (('NEW-MESSAGE', new_message_frame()), ('CONVERSATION x50', conversation_frame())):
+        print(f"{name}")
+        for serializer_name, serializer in SERIALIZERS.items():
+            size, per_sec, mb_per_sec = bench(frame, serializer, iterations)
+            print(f"  {serializer_name:<28} {size:>7} B  {per_sec:>12,.0f} frames/s  {mb_per_sec:>8.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
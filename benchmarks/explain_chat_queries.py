@@ -0,0 +1,107 @@
+"""
+EXPLAIN-based check that the hot chat queries are served by their indexes.
+
+    python -m benchmarks.explain_chat_queries
+
+Runs the real CRUD functions against a throwaway SQLite database, captures the
+SQL they emit, and fails (exit code 1) when a plan doesn't use an expected index.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'explain.db')}"
+
+from sqlalchemy import event  # noqa: E402
+
+from api.database import Base, SessionLocal, engine  # noqa: E402
+from api.public.chat.cache import recent_messages  # noqa: E402
+from api.public.chat.crud import (  # noqa: E402
+    fetch_single_conversation_upto_a_certain_time,
+    fetch_undelivered_chats,
+    get_chats_by_conversation,
+    save_chats_in_bulk,
+)
+from api.public.chat.schemas import ChatCreate  # noqa: E402
+
+
+CONVERSATION_INDEXES = {'ix_chat_conversation_id_id', 'ix_chat_conversation_id_created_at'}
+
+
+CHECKS = [
+    ('newest history page', {'ix_chat_conversation_id_id'},
+     lambda db: fetch_single_conversation_upto_a_certain_time('5', '7', db, limit=20)),
+    ('older page before a cursor', {'ix_chat_conversation_id_id'},
+     lambda db: fetch_single_conversation_upto_a_certain_time('5', '7', db, before_id=400, limit=20)),
+    ('newer page after a cursor', {'ix_chat_conversation_id_id'},
+     lambda db: fetch_single_conversation_upto_a_certain_time('5', '7', db, after_id=100, limit=20)),
+    ('history up to a timestamp', CONVERSATION_INDEXES,
+     lambda db: fetch_single_conversation_upto_a_certain_time('5', '7', db, max_timestamp=1, limit=20)),
+    ('whole conversation', CONVERSATION_INDEXES,
+     lambda db: get_chats_by_conversation('5', '7', db)),
+    ('undelivered per receiver', {'ix_chat_receiver_id_undelivered'},
+     lambda db: fetch_undelivered_chats('7', db)),
+    ('undelivered per receiver after a cursor', {'ix_chat_receiver_id_undelivered'},
+     lambda db: fetch_undelivered_chats('7', db, after_id=100)),
+]
+
+
+async def seed():
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with SessionLocal() as db:
+        await save_chats_in_bulk([
+            ChatCreate(sender_id=str(i % 10), receiver_id=(i + 3) % 10 or 10, text=f'chat {i}')
+            for i in range(500)
+        ], db)
+
+
+async def plan_of(check):
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    # Pages served from memory would not reach the database at all
+    recent_messages.clear()
+    event.listen(engine.sync_engine, 'before_cursor_execute', capture)
+    try:
+        async with SessionLocal() as db:
+            await check(db)
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', capture)
+    plans = []
+    async with engine.connect() as connection:
+        for statement, parameters in captured:
+            rows = await connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)
+            plans.append([row[-1] for row in rows])
+    return plans
+
+
+def uses_index(plan, indexes):
+    full_scan = any(step.strip() == 'SCAN chat' for step in plan)
+    return not full_scan and any(index in step for step in plan for index in indexes)
+
+
+async def main():
+    failures = 0
+    try:
+        await seed()
+        for name, indexes, check in CHECKS:
+            plans = await plan_of(check)
+            if not plans:
+                failures += 1
+                print(f"FAIL {name}: no query was run")
+            for plan in plans:
+                ok = uses_index(plan, indexes)
+                failures += not ok
+                print(f"{'ok  ' if ok else 'FAIL'} {name}: {' / '.join(plan)}")
+    finally:
+        await engine.dispose()
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,45 @@
+"""chat outbox
+
+Revision ID: 4b1f6e02a9d3
+Revises: ee4df8b139db
+Create Date: 2026-10-18 15:04:21.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1f6e02a9d3'
+down_revision = 'ee4df8b139db'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('chat_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('sender_id', sa.String(), nullable=False),
+    sa.Column('kind', sa.String(), server_default='chat', nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('dead_letter', sa.Boolean(), server_default=sa.false(), nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['chat.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('chat_id', 'kind')
+    )
+    with op.batch_alter_table('chat_outbox', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_outbox_sender_id_id', ['sender_id', 'id'], unique=False)
+
+    with op.batch_alter_table('chat', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('upstream_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('chat', schema=None) as batch_op:
+        batch_op.drop_column('upstream_id')
+
+    with op.batch_alter_table('chat_outbox', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_outbox_sender_id_id')
+
+    op.drop_table('chat_outbox')
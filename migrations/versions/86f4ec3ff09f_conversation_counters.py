@@ -0,0 +1,86 @@
+"""conversation counters
+
+Revision ID: 86f4ec3ff09f
+Revises: cfd7258c8984
+Create Date: 2026-10-18 14:21:40.118529
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '86f4ec3ff09f'
+down_revision = 'cfd7258c8984'
+branch_labels = None
+depends_on = None
+
+
+chat = sa.table(
+    'chat',
+    sa.column('id', sa.Integer),
+    sa.column('receiver_id', sa.String),
+    sa.column('conversation_id', sa.String),
+    sa.column('created_at', sa.Integer),
+    sa.column('delivered', sa.Boolean),
+)
+conversation = sa.table(
+    'conversation',
+    sa.column('id', sa.String),
+    sa.column('message_count', sa.Integer),
+    sa.column('last_message_id', sa.Integer),
+    sa.column('last_activity_at', sa.Integer),
+)
+user_conversation = sa.table(
+    'user_conversation',
+    sa.column('user_id', sa.String),
+    sa.column('conversation_id', sa.String),
+    sa.column('unread_count', sa.Integer),
+)
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('last_message_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_activity_at', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('user_conversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Same computation as api.public.chat.repair
+    last_message_id = sa.select(sa.func.max(chat.c.id)).where(
+        chat.c.conversation_id == conversation.c.id
+    ).correlate(conversation).scalar_subquery()
+    op.execute(
+        conversation.update().values(
+            message_count=sa.select(sa.func.count()).select_from(chat).where(
+                chat.c.conversation_id == conversation.c.id
+            ).scalar_subquery(),
+            last_message_id=last_message_id,
+            last_activity_at=sa.select(chat.c.created_at).where(
+                chat.c.id == last_message_id
+            ).scalar_subquery(),
+        )
+    )
+    op.execute(
+        user_conversation.update().values(
+            unread_count=sa.select(sa.func.count()).select_from(chat).where(
+                sa.and_(
+                    chat.c.conversation_id == user_conversation.c.conversation_id,
+                    chat.c.receiver_id == user_conversation.c.user_id,
+                    chat.c.delivered == sa.false(),
+                )
+            ).scalar_subquery(),
+        )
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('user_conversation', schema=None) as batch_op:
+        batch_op.drop_column('unread_count')
+
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.drop_column('last_activity_at')
+        batch_op.drop_column('last_message_id')
+        batch_op.drop_column('message_count')
@@ -0,0 +1,44 @@
+"""backfill user_conversation
+
+Revision ID: cfd7258c8984
+Revises: 367f6d760b57
+Create Date: 2026-10-18 14:10:12.402311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'cfd7258c8984'
+down_revision = '367f6d760b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Conversation membership is now written along with every chat,
+    # fill it in for the chats saved before that
+    op.execute(sa.text(
+        """
+        INSERT INTO user_conversation (user_id, conversation_id)
+        SELECT members.user_id, members.conversation_id
+        FROM (
+            SELECT sender_id AS user_id, conversation_id FROM chat
+            UNION
+            SELECT receiver_id AS user_id, conversation_id FROM chat
+        ) AS members
+        WHERE members.user_id IS NOT NULL
+          AND members.conversation_id IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM user_conversation existing
+              WHERE existing.user_id = members.user_id
+                AND existing.conversation_id = members.conversation_id
+          )
+        """
+    ))
+
+
+def downgrade() -> None:
+    # The table predates this revision, backfilled rows stay valid
+    pass
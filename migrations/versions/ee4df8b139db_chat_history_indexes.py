@@ -0,0 +1,37 @@
+"""chat history indexes
+
+Revision ID: ee4df8b139db
+Revises: 86f4ec3ff09f
+Create Date: 2026-10-18 14:32:05.671420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ee4df8b139db'
+down_revision = '86f4ec3ff09f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    undelivered = sa.column('delivered', sa.Boolean) == sa.false()
+    with op.batch_alter_table('chat', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_conversation_id_id', ['conversation_id', 'id'], unique=False)
+        batch_op.create_index('ix_chat_conversation_id_created_at', ['conversation_id', 'created_at'], unique=False)
+        batch_op.create_index(
+            'ix_chat_receiver_id_undelivered',
+            ['receiver_id', 'id'],
+            unique=False,
+            sqlite_where=undelivered,
+            postgresql_where=undelivered,
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('chat', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_receiver_id_undelivered')
+        batch_op.drop_index('ix_chat_conversation_id_created_at')
+        batch_op.drop_index('ix_chat_conversation_id_id')